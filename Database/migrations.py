@@ -0,0 +1,115 @@
+# Brings an existing database up to the schema in models.py: creates missing
+# tables, adds missing nullable columns, merges duplicate holdings and creates
+# the indexes and unique constraints, and rebuilds portfolio_aggregates for
+# users whose rows don't match their trade history. Safe to run repeatedly.
+#
+#   python -m Database.migrations
+from sqlalchemy import String, Text, func, inspect, select, text
+
+from . import models
+from .sql import Base
+
+def add_missing_columns(connection):
+    inspector = inspect(connection)
+    added = []
+
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} automatically")
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+            added.append(f"{table.name}.{column.name}")
+
+    return added
+
+def merge_duplicate_holdings(connection):
+    # Folds duplicate (user_id, token_id) holdings into the oldest row so the
+    # unique index can be created
+    holdings = models.CryptoHoldings.__table__
+
+    duplicates = connection.execute(
+        select(holdings.c.user_id, holdings.c.token_id, func.min(holdings.c.transaction_id), func.sum(holdings.c.quantity))
+        .group_by(holdings.c.user_id, holdings.c.token_id)
+        .having(func.count() > 1)
+    ).all()
+
+    for user_id, token_id, keep_id, quantity in duplicates:
+        connection.execute(holdings.update().where(holdings.c.transaction_id == keep_id).values(quantity=quantity))
+        connection.execute(holdings.delete().where(
+            holdings.c.user_id == user_id,
+            holdings.c.token_id == token_id,
+            holdings.c.transaction_id != keep_id,
+        ))
+
+    return len(duplicates)
+
+def create_indexes(connection):
+    inspector = inspect(connection)
+    created = []
+
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                created.append(index.name)
+
+    return created
+
+def reset_analytics_results(connection):
+    # analytics_results only caches computed results; one from before results
+    # were stored as JSON is dropped and recreated rather than converted
+    inspector = inspect(connection)
+    if not inspector.has_table("analytics_results"):
+        return False
+
+    result_type = next(column["type"] for column in inspector.get_columns("analytics_results") if column["name"] == "result")
+    if isinstance(result_type, (String, Text)):
+        return False
+
+    models.AnalyticsResults.__table__.drop(connection)
+    return True
+
+def backfill_portfolio_aggregates(engine):
+    # portfolio_aggregates only follows trades made since it was created, so
+    # users whose stored rows differ from a replay of their history (older
+    # trades missing, or no rows at all) get theirs rebuilt. Returns how many
+    # users were rebuilt
+    from sqlalchemy.orm import Session
+
+    from portfolio import rebuild_aggregates, verify_aggregates
+    from stress import UID_CHUNK_SIZE
+
+    with Session(engine) as db:
+        uids = sorted({mismatch[0] for mismatch in verify_aggregates(db)})
+        for i in range(0, len(uids), UID_CHUNK_SIZE):
+            rebuild_aggregates(db, uids[i:i + UID_CHUNK_SIZE])
+
+    return len(uids)
+
+def migrate(engine):
+    with engine.begin() as connection:
+        reset = reset_analytics_results(connection)
+
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as connection:
+        added = add_missing_columns(connection)
+        merged = merge_duplicate_holdings(connection)
+        created = create_indexes(connection)
+
+    rebuilt = backfill_portfolio_aggregates(engine)
+
+    return {"analytics_results_reset": reset, "columns_added": added, "holdings_merged": merged, "indexes_created": created, "aggregate_users_rebuilt": rebuilt}
+
+if __name__ == "__main__":
+    from .sql import engine
+
+    for step, result in migrate(engine).items():
+        print(step, result)
@@ -1,5 +1,5 @@
 from .sql import Base
-from sqlalchemy import DATE, TIMESTAMP, Column, Integer, String, ForeignKey, Float
+from sqlalchemy import DATE, TIMESTAMP, Column, Integer, String, Text, ForeignKey, Float, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
@@ -34,6 +34,12 @@ class AccountTransactions(Base):
 
     transaction_time = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_transactions_accounts_user_id_time", "user_id", "transaction_time", "transaction_id"),
+        # Keyset pagination of a user's history
+        Index("ix_transactions_accounts_user_id_id", "user_id", "transaction_id"),
+    )
+
 class CryptoTransactions(Base):
 
     __tablename__ = "transactions_crypto"
@@ -52,6 +58,12 @@ class CryptoTransactions(Base):
 
     transaction_time = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
 
+    __table_args__ = (
+        Index("ix_transactions_crypto_user_id_time", "user_id", "transaction_time", "transaction_id"),
+        # Keyset pagination of a user's history and the newest trade per user
+        Index("ix_transactions_crypto_user_id_id", "user_id", "transaction_id"),
+    )
+
 
 class CryptoHoldings(Base):
     __tablename__ = "crypto_holdings"
@@ -67,12 +79,82 @@ class CryptoHoldings(Base):
 
     bought_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
 
+    # One holding row per user and token; also serves the per-user lookups
+    __table_args__ = (Index("uq_crypto_holdings_user_id_token_id", "user_id", "token_id", unique=True),)
+
+class PortfolioAggregates(Base):
+    # Running per-user/per-token totals, updated in the same transaction as
+    # every trade. `python portfolio.py rebuild` recomputes them from
+    # transactions_crypto.
+    __tablename__ = "portfolio_aggregates"
+
+    user_id = Column(String(100), ForeignKey("users.uid"), primary_key=True)
+    token_id = Column(String(50), primary_key=True)
+
+    token_name = Column(String(50), nullable=False)
+    token_symbol = Column(String(50), nullable=False)
+
+    quantity = Column(Float, nullable=False, default=0)
+    # Bought minus sold, at the prices traded
+    net_cost = Column(Float, nullable=False, default=0)
+    # Totals over buys only, for the average buying price
+    buy_cost = Column(Float, nullable=False, default=0)
+    buy_quantity = Column(Float, nullable=False, default=0)
+    realized_pl = Column(Float, nullable=False, default=0)
+
+    time_updated = Column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class CryptoPrices(Base):
+    __tablename__ = "crypto_prices"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    token_id = Column(String(50), nullable=False)
+    token_name = Column(String(50), nullable=False)
+    token_symbol = Column(String(50), nullable=False)
+
+    token_price = Column(Float, nullable=False)
+
+    timestamp = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (Index("ix_crypto_prices_token_id_timestamp", "token_id", "timestamp"),)
+
+class LatestCryptoPrices(Base):
+    # One row per token, refreshed with every snapshot written to crypto_prices
+    __tablename__ = "crypto_prices_latest"
+
+    token_id = Column(String(50), primary_key=True)
+    token_name = Column(String(50), nullable=False)
+    token_symbol = Column(String(50), nullable=False)
+
+    token_price = Column(Float, nullable=False)
+
+    timestamp = Column(TIMESTAMP(timezone=True), nullable=False)
+
 class VolatilityIndex(Base):
     __tablename__ = 'volatilityindex'
 
     normalized_volatility_index = Column(Float, nullable=False)
+    # Raw cross-sectional std of daily returns, kept so the window can be renormalized
+    volatility_index = Column(Float)
     date = Column(TIMESTAMP, nullable=False, primary_key=True , server_default=func.now())
 
+class AnalyticsResults(Base):
+    # Results computed by the analytics workers, one per kind, subject (a uid)
+    # and volatility index day
+    __tablename__ = "analytics_results"
+
+    kind = Column(String(50), primary_key=True)
+    subject = Column(String(100), primary_key=True)
+    volatility_date = Column(TIMESTAMP, primary_key=True)
+
+    # Newest transactions_crypto id the result saw; 0 for users without trades
+    as_of = Column(Integer, nullable=False)
+    # JSON-encoded, so predictions keep their type
+    result = Column(Text, nullable=False)
+
+    computed_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
 class Feeling(Base):
     __tablename__ = 'feelings'
 
@@ -81,3 +163,5 @@ class Feeling(Base):
     feeling = Column(String)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
+    __table_args__ = (Index("ix_feelings_user_id", "user_id"),)
+
@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+
+from . import models
+from .upsert import upsert
+
+def snapshot_rows(coins, timestamp=None):
+    timestamp = timestamp or datetime.now(timezone.utc)
+
+    return [
+        {
+            "token_id": coin["uuid"],
+            "token_name": coin["name"],
+            "token_symbol": coin["symbol"],
+            "token_price": float(coin["price"]),
+            "timestamp": timestamp,
+        }
+        for coin in coins
+        if coin.get("price") is not None
+    ]
+
+async def store_snapshot(db, coins):
+    # One executemany into the history table and one into the latest table
+    rows = snapshot_rows(coins)
+    if not rows:
+        return 0
+
+    await db.execute(insert(models.CryptoPrices), rows)
+    await db.execute(
+        upsert(db.bind.dialect.name, models.LatestCryptoPrices.__table__, ["token_id"], ["token_name", "token_symbol", "token_price", "timestamp"]),
+        rows,
+    )
+    await db.commit()
+
+    return len(rows)
+
+def latest_prices_query(token_ids=None):
+    query = select(models.LatestCryptoPrices)
+    if token_ids is not None:
+        query = query.filter(models.LatestCryptoPrices.token_id.in_(token_ids))
+    return query
@@ -0,0 +1,8 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+class Order(BaseModel):
+    token_id: str
+    side: Literal["BUY", "SELL"]
+    quantity: float = Field(..., gt=0)
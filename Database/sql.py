@@ -1,13 +1,109 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
+import logging
 import os
+import time
 load_dotenv()
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASEURL")
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+logger = logging.getLogger(__name__)
+
+def env_flag(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def echo_setting(value):
+    # DB_ECHO: off (default), info/true to log every statement, debug to log rows too
+    value = (value or "").strip().lower()
+    if value == "debug":
+        return "debug"
+    return value in ("1", "true", "yes", "on", "info")
+
+def default_pool_size():
+    # Split DB_MAX_CONNECTIONS between the workers, each with a sync and an async pool
+    if os.getenv("DB_POOL_SIZE"):
+        return int(os.getenv("DB_POOL_SIZE"))
+    if os.getenv("DB_MAX_CONNECTIONS"):
+        workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+        return max(1, int(os.getenv("DB_MAX_CONNECTIONS")) // (workers * 2))
+    return 5
+
+DB_POOL_SIZE = default_pool_size()
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", True)
+DB_ECHO = echo_setting(os.getenv("DB_ECHO"))
+# Statements slower than this are logged with their timing; 0 turns it off
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+
+def engine_options(url):
+    options = {
+        "echo": DB_ECHO,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    # SQLite uses a per-thread/static pool that takes no sizing
+    if not url.startswith("sqlite"):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+def log_slow_queries(sync_engine, threshold_ms=DB_SLOW_QUERY_MS):
+    if threshold_ms <= 0:
+        return
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def log_if_slow(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started_at"].pop()) * 1000
+        if elapsed_ms >= threshold_ms:
+            logger.warning("Slow query (%.1f ms): %s", elapsed_ms, statement)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def drop_timer(context):
+        # after_cursor_execute doesn't run for failed statements. The list is
+        # empty if the failure came before the cursor ran (ExceptionContext
+        # has no usable cursor attribute to tell)
+        started = context.connection.info.get("query_started_at") if context.connection is not None else None
+        if started:
+            started.pop()
+
+def create_db_engine(url):
+    engine = create_engine(url, **engine_options(url))
+    log_slow_queries(engine)
+    return engine
+
+def create_async_db_engine(url):
+    engine = create_async_engine(url, **engine_options(url))
+    log_slow_queries(engine.sync_engine)
+    return engine
+
+def async_database_url(url):
+    # Same database as DATABASEURL, reached through an asyncio driver
+    for prefix, async_prefix in (("postgresql+psycopg2://", "postgresql+asyncpg://"),
+                                 ("postgresql://", "postgresql+asyncpg://"),
+                                 ("postgres://", "postgresql+asyncpg://"),
+                                 ("sqlite://", "sqlite+aiosqlite://")):
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv("ASYNC_DATABASEURL") or async_database_url(SQLALCHEMY_DATABASE_URL)
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# Used by the async endpoints so trades don't block the event loop
+async_engine = create_async_db_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
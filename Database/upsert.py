@@ -0,0 +1,19 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+def dialect_insert(dialect_name, table):
+    # INSERT that supports ON CONFLICT on the databases we run on
+    if dialect_name == "postgresql":
+        return postgresql.insert(table)
+    elif dialect_name == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"upsert is not supported on {dialect_name}")
+
+def upsert(dialect_name, table, index_elements, update_columns):
+    # INSERT ... ON CONFLICT DO UPDATE; execute it with a list of rows to
+    # upsert them in one executemany
+    stmt = dialect_insert(dialect_name, table)
+
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: stmt.excluded[column] for column in update_columns},
+    )
@@ -0,0 +1,303 @@
+# CPU-bound analytics (stress predictions, volatility refreshes) run here,
+# off the API workers' GIL. ANALYTICS_BACKEND=process (the default) uses a
+# pool of ANALYTICS_WORKERS processes; inline runs each job in the calling
+# thread, for tests and single-process setups.
+#
+# Stress metrics are stored in analytics_results per uid and volatility day
+# and reused until the user trades again, so repeated requests are a lookup.
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+
+from metrics import run_in_threadpool
+
+from Database import models
+from Database.sql import SessionLocal
+from Database.upsert import upsert
+from model_registry import stress_model
+from stress import UID_CHUNK_SIZE, latest_transaction_ids, stress_features
+
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "process")
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "2"))
+# How long a request waits for its job before answering with the job id
+ANALYTICS_WAIT_SECONDS = float(os.getenv("ANALYTICS_WAIT_SECONDS", "5"))
+# Finished jobs stay visible at /jobs/{job_id} for this long
+ANALYTICS_JOB_RETENTION_SECONDS = float(os.getenv("ANALYTICS_JOB_RETENTION_SECONDS", "600"))
+
+STRESS = "stress"
+VOLATILITY = "volatility"
+
+
+# Jobs, run in the worker processes
+
+def load_worker():
+    # Each worker loads the model once, before its first job
+    try:
+        stress_model.load()
+    except FileNotFoundError:
+        print("Stress model not found at", stress_model.path)
+
+def stress_job(uids, volatility_date):
+    with SessionLocal() as db:
+        market_volatility = db.query(models.VolatilityIndex.normalized_volatility_index).filter(models.VolatilityIndex.date == volatility_date).scalar()
+        if market_volatility is None:
+            raise LookupError(f"No volatility index for {volatility_date}")
+
+        # Read before the features, so a trade landing in between makes the stored result stale rather than wrong
+        as_of = latest_transaction_ids(db, uids)
+        features = stress_features(db, uids, market_volatility)
+        stress_metrics = stress_model.predict(features).tolist()
+
+        # Stored as JSON so labels of any type (ints, strings) come back unchanged
+        results = {uid: json.dumps(metric) for uid, metric in zip(uids, stress_metrics)}
+
+        computed_at = datetime.now(timezone.utc)
+        rows = [
+            {"kind": STRESS, "subject": uid, "volatility_date": volatility_date, "as_of": as_of[uid], "result": result, "computed_at": computed_at}
+            for uid, result in results.items()
+        ]
+        db.execute(upsert(db.bind.dialect.name, models.AnalyticsResults.__table__, ["kind", "subject", "volatility_date"], ["as_of", "result", "computed_at"]), rows)
+        db.commit()
+
+    # Decoded from the stored JSON, so a fresh result looks exactly like a stored one
+    return {uid: json.loads(result) for uid, result in results.items()}
+
+def volatility_job():
+    from volatility import refresh_volatility
+
+    with SessionLocal() as db:
+        return refresh_volatility(db)
+
+def with_model_metrics(fn, *args):
+    # Runs a job and sends the worker's stress model counters back with its result
+    result = fn(*args)
+    return os.getpid(), stress_model.metrics(), result
+
+
+# Stored results
+
+def stored_stress_metrics(db, uids, volatility_date):
+    # Metrics computed for this volatility day whose user hasn't traded since
+    as_of = latest_transaction_ids(db, uids)
+    uids = list(as_of)
+    stored = {}
+
+    for i in range(0, len(uids), UID_CHUNK_SIZE):
+        chunk = uids[i:i + UID_CHUNK_SIZE]
+        rows = db.query(models.AnalyticsResults).filter(
+            models.AnalyticsResults.kind == STRESS,
+            models.AnalyticsResults.volatility_date == volatility_date,
+            models.AnalyticsResults.subject.in_(chunk),
+        ).all()
+        stored.update({row.subject: json.loads(row.result) for row in rows if row.as_of == as_of[row.subject]})
+
+    return stored
+
+def stored_metrics_and_release(db, uids, volatility_date):
+    stored = stored_stress_metrics(db, uids, volatility_date)
+    # Don't hold a connection (or, on SQLite, a read lock) while the worker writes
+    db.rollback()
+    return stored
+
+
+# Backends
+
+class InlineBackend:
+    in_process = True
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self):
+        pass
+
+class ProcessBackend:
+    in_process = False
+
+    def __init__(self, workers=ANALYTICS_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._start()
+            try:
+                return self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM killed); start a fresh pool
+                self._executor = self._start()
+                return self._executor.submit(fn, *args)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _start(self):
+        # Started on first use so API startup doesn't wait for it. Spawned
+        # rather than forked, so workers open their own connections instead
+        # of sharing the API's pooled ones
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=load_worker)
+
+
+class AnalyticsPool:
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.failed = 0
+        self.stored_hits = 0
+        # Latest stress model counters per worker process
+        self._model_metrics = {}
+
+    @classmethod
+    def from_env(cls):
+        if ANALYTICS_BACKEND == "inline":
+            return cls(InlineBackend())
+        return cls(ProcessBackend())
+
+    def submit(self, kind, fn, *args):
+        # Identical jobs still running share one job id and one computation
+        job_id = hashlib.sha256(json.dumps([kind, fn.__name__, args], default=str).encode()).hexdigest()[:32]
+
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job is not None and not job["future"].done():
+                return job_id
+            job = {"kind": kind, "future": Future(), "finished_at": None}
+            job["future"].add_done_callback(lambda future: self._finished(job, future))
+            self._jobs[job_id] = job
+            self.submitted += 1
+
+        # Outside the lock: the inline backend runs the whole job right here
+        try:
+            worker_future = self.backend.submit(with_model_metrics, fn, *args)
+        except Exception as e:
+            job["future"].set_exception(e)
+            raise
+        worker_future.add_done_callback(lambda worker_future: self._unwrap(job["future"], worker_future))
+        return job_id
+
+    async def submit_async(self, kind, fn, *args):
+        # In a thread so the inline backend doesn't run the job on the event loop
+        return await run_in_threadpool(self.submit, kind, fn, *args)
+
+    async def wait(self, job_id, timeout=ANALYTICS_WAIT_SECONDS):
+        # The job's result, or None if it is still running after timeout
+        # seconds. Shielded, so a timeout leaves the job running.
+        future = asyncio.wrap_future(self._jobs[job_id]["future"])
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def run(self, kind, fn, *args):
+        job_id = await self.submit_async(kind, fn, *args)
+        return await asyncio.wrap_future(self._jobs[job_id]["future"])
+
+    def job(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+
+        status = {"job_id": job_id, "kind": job["kind"], "status": "Pending"}
+        future = job["future"]
+        if future.cancelled():
+            status.update(status="Failed", error="cancelled")
+        elif future.done():
+            if future.exception() is not None:
+                status.update(status="Failed", error=str(future.exception()))
+            else:
+                status.update(status="Success", result=future.result())
+        return status
+
+    async def stress_metrics(self, db, uids, volatility_date, wait=ANALYTICS_WAIT_SECONDS):
+        # Returns (metrics by uid, None), or (None, job_id) while the missing ones are still being computed
+        uids = list(dict.fromkeys(uids))
+        metrics = await run_in_threadpool(stored_metrics_and_release, db, uids, volatility_date)
+        self.stored_hits += len(metrics)
+
+        missing = [uid for uid in uids if uid not in metrics]
+        if not missing:
+            return metrics, None
+
+        job_id = await self.submit_async(STRESS, stress_job, missing, volatility_date)
+        computed = await self.wait(job_id, wait)
+        if computed is None:
+            return None, job_id
+
+        metrics.update(computed)
+        return {uid: metrics[uid] for uid in uids}, None
+
+    def stats(self):
+        with self._lock:
+            pending = sum(not job["future"].done() for job in self._jobs.values())
+        return {
+            "backend": "inline" if self.backend.in_process else "process",
+            "pending": pending,
+            "submitted": self.submitted,
+            "failed": self.failed,
+            "stored_hits": self.stored_hits,
+        }
+
+    def model_metrics(self):
+        # The stress model counters of every worker, summed; same keys as ModelRegistry.metrics
+        snapshots = dict(self._model_metrics)
+        if self.backend.in_process:
+            snapshots[os.getpid()] = stress_model.metrics()
+
+        predictions = sum(snapshot["predictions"] for snapshot in snapshots.values())
+        predict_seconds = sum(snapshot["predict_seconds"] for snapshot in snapshots.values())
+        return {
+            "path": stress_model.path,
+            "workers": len(snapshots),
+            "loaded": any(snapshot["loaded"] for snapshot in snapshots.values()),
+            "digest": next((snapshot["digest"] for snapshot in snapshots.values() if snapshot["digest"]), None),
+            "loads": sum(snapshot["loads"] for snapshot in snapshots.values()),
+            "load_seconds": max((snapshot["load_seconds"] for snapshot in snapshots.values()), default=0.0),
+            "predictions": predictions,
+            "predict_seconds": predict_seconds,
+            "predict_seconds_avg": predict_seconds / predictions if predictions else None,
+        }
+
+    def shutdown(self):
+        self.backend.shutdown()
+
+    def _unwrap(self, future, worker_future):
+        if worker_future.cancelled():
+            future.cancel()
+        elif worker_future.exception() is not None:
+            future.set_exception(worker_future.exception())
+        else:
+            pid, model_metrics, result = worker_future.result()
+            self._model_metrics[pid] = model_metrics
+            future.set_result(result)
+
+    def _finished(self, job, future):
+        job["finished_at"] = time.monotonic()
+        if not future.cancelled() and future.exception() is not None:
+            self.failed += 1
+
+    def _prune(self):
+        cutoff = time.monotonic() - ANALYTICS_JOB_RETENTION_SECONDS
+        for job_id in [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None and job["finished_at"] < cutoff]:
+            del self._jobs[job_id]
@@ -0,0 +1,70 @@
+# Query throughput of the previous engine setup (echo=True, default pool)
+# against the configurable factory in Database/sql.py, using several threads
+# the way the FastAPI threadpool does.
+#
+#   python -m benchmarks.bench_engine_settings --threads 8 --queries 5000
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run(engine, threads, queries):
+    from sqlalchemy.orm import Session
+    from Database import models
+
+    def worker(n):
+        with Session(engine) as db:
+            for i in range(n):
+                db.query(models.User).filter(models.User.uid == f"user-{i % 100}").first()
+
+    per_thread = queries // threads
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, [per_thread] * threads))
+    return per_thread * threads / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=4000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASEURL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "engine.db"))
+
+    from datetime import date
+    from sqlalchemy import create_engine
+    from Database import models
+    from Database.sql import SQLALCHEMY_DATABASE_URL, create_db_engine
+
+    configured = create_db_engine(SQLALCHEMY_DATABASE_URL)
+    models.Base.metadata.create_all(bind=configured)
+    with configured.begin() as connection:
+        connection.execute(models.User.__table__.delete())
+        connection.execute(models.User.__table__.insert(), [
+            {"uid": f"user-{i}", "First_Name": "Bench", "Last_Name": "User", "Email": "bench@example.com", "Current_Balance": 0.0, "Account_Status": 1, "created_date": date.today()}
+            for i in range(100)
+        ])
+
+    # echo=True logs every statement to stdout; point that at /dev/null so the
+    # terminal isn't what gets measured
+    import sys
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        legacy = create_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+        legacy_throughput = run(legacy, args.threads, args.queries)
+    finally:
+        sys.stdout = stdout
+
+    results = {"echo=True, default pool": legacy_throughput,
+               "configured factory": run(configured, args.threads, args.queries)}
+
+    for name, throughput in results.items():
+        print(f"{name:<26} {throughput:>10.0f} queries/s")
+
+
+if __name__ == "__main__":
+    main()
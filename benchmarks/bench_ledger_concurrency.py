@@ -0,0 +1,105 @@
+# Hammers one account with concurrent deposits, withdrawals, buys and sells
+# and checks that no update was lost and the balance never went negative.
+#
+#   python -m benchmarks.bench_ledger_concurrency --requests 2000 --concurrency 64
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+from benchmarks.stubs import COINS, start_coinranking_stub
+
+UID = "ledger-stress"
+
+
+async def run(args):
+    import httpx
+    import main
+    from sqlalchemy import func
+    from Database import models
+    from Database.migrations import migrate
+    from Database.sql import SessionLocal, engine
+
+    migrate(engine)
+
+    with SessionLocal() as db:
+        db.add(models.User(uid=UID, First_Name="Ledger", Last_Name="Stress", Email="ledger@example.com", Current_Balance=args.initial_balance, Account_Status=1, created_date=date.today()))
+        db.commit()
+
+    coin = COINS[0]
+    price = float(coin["price"])
+    semaphore = asyncio.Semaphore(args.concurrency)
+    outcomes = {"deposit": 0, "withdraw": 0, "withdraw_refused": 0, "buy": 0, "buy_refused": 0, "sell": 0, "sell_refused": 0, "error": 0}
+
+    async def request(client, kind):
+        async with semaphore:
+            if kind == "deposit":
+                response = await client.post("/add_balance", params={"uid": UID, "quantity": args.amount})
+            elif kind == "withdraw":
+                response = await client.post("/withdraw_money", params={"uid": UID, "quantity": args.amount})
+            elif kind == "buy":
+                response = await client.post(f"/users/{UID}/buy_crypto", params={"token_id": coin["uuid"], "quantity": args.amount / price})
+            else:
+                response = await client.post(f"/users/{UID}/sell_crypto", params={"token_id": coin["uuid"], "quantity": args.amount / price})
+
+        if response.status_code != 200:
+            outcomes["error"] += 1
+        elif response.json().get("status") == "Success":
+            outcomes[kind] += 1
+        else:
+            outcomes[kind + "_refused"] += 1
+
+    kinds = random.choices(["deposit", "withdraw", "buy", "sell"], weights=[1, 2, 2, 1], k=args.requests)
+    async with httpx.AsyncClient(app=main.app, base_url="http://bench", timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[request(client, kind) for kind in kinds])
+        elapsed = time.perf_counter() - started
+    await main.price_client.close()
+
+    with SessionLocal() as db:
+        balance = db.query(models.User.Current_Balance).filter(models.User.uid == UID).scalar()
+        holding = db.query(models.CryptoHoldings.quantity).filter(models.CryptoHoldings.user_id == UID).scalar() or 0.0
+        ledger_rows = db.query(func.count()).select_from(models.AccountTransactions).filter(models.AccountTransactions.user_id == UID).scalar()
+        trade_rows = db.query(func.count()).select_from(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == UID).scalar()
+
+    expected_balance = args.initial_balance + args.amount * (outcomes["deposit"] - outcomes["withdraw"] - outcomes["buy"] + outcomes["sell"])
+    expected_holding = args.amount / price * (outcomes["buy"] - outcomes["sell"])
+
+    print(f"{args.requests} requests at concurrency {args.concurrency} in {elapsed:.2f}s ({args.requests / elapsed:.0f} req/s)")
+    print("outcomes:", outcomes)
+    print(f"balance  {balance:.6f} expected {expected_balance:.6f}")
+    print(f"holding  {holding:.9f} expected {expected_holding:.9f}")
+
+    ok = (
+        abs(balance - expected_balance) < 1e-6 * max(1.0, expected_balance)
+        and abs(holding - expected_holding) < 1e-9 * max(1.0, expected_holding) + 1e-12
+        and balance >= -1e-9 and holding >= -1e-12
+        and ledger_rows == outcomes["deposit"] + outcomes["withdraw"]
+        and trade_rows == outcomes["buy"] + outcomes["sell"]
+        and outcomes["error"] == 0
+    )
+    print("OK" if ok else "FAILED: lost or phantom updates")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--initial-balance", type=float, default=500.0)
+    parser.add_argument("--amount", type=float, default=10.0)
+    args = parser.parse_args()
+
+    base_url, _ = start_coinranking_stub()
+    os.environ.setdefault("DATABASEURL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "ledger.db"))
+    os.environ["COINRANKING_BASE_URL"] = base_url
+    os.environ["VOLATILITY_REFRESH_SECONDS"] = "0"
+
+    raise SystemExit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# Seeds synthetic users/transactions/holdings, then records the query plan and
+# p50/p99 latency of each endpoint's per-user query without the secondary
+# indexes ("before") and after Database.migrations has created them.
+#
+#   python -m benchmarks.bench_query_plans --rows 2000000 --output plans.json
+# Uses DATABASEURL if set (e.g. a local Postgres), otherwise a temporary SQLite file.
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.stubs import COINS
+
+
+def endpoint_queries(models, uid, token_id):
+    from sqlalchemy import func, select
+
+    return {
+        "get_user": select(models.User).filter(models.User.uid == uid),
+        "crypto_transactions": select(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid).order_by(models.CryptoTransactions.transaction_id.desc()).limit(101),
+        "crypto_transactions_info": select(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid).order_by(models.CryptoTransactions.transaction_time, models.CryptoTransactions.transaction_id),
+        "fiat_transactions": select(models.AccountTransactions).filter(models.AccountTransactions.user_id == uid).order_by(models.AccountTransactions.transaction_id.desc()).limit(101),
+        "crypto_holdings": select(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == uid).filter(models.CryptoHoldings.quantity != 0).order_by(models.CryptoHoldings.bought_at.desc()),
+        "get_crypto_holding": select(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == uid).filter(models.CryptoHoldings.token_id == token_id),
+        "initial_portfolio_value": select(func.sum(models.PortfolioAggregates.net_cost)).filter(models.PortfolioAggregates.user_id == uid),
+        "feelings": select(models.Feeling).filter(models.Feeling.user_id == uid),
+    }
+
+
+def seed(engine, models, users, rows):
+    start = datetime(2023, 1, 1)
+    uids = [f"user-{i}" for i in range(users)]
+
+    with engine.begin() as connection:
+        connection.execute(models.User.__table__.insert(), [
+            {"uid": uid, "First_Name": "Synthetic", "Last_Name": "User", "Email": f"{uid}@example.com", "Current_Balance": 1000.0, "Account_Status": 1, "created_date": start.date()}
+            for uid in uids
+        ])
+        connection.execute(models.CryptoHoldings.__table__.insert(), [
+            {"user_id": uid, "token_id": coin["uuid"], "token_name": coin["name"], "token_symbol": coin["symbol"], "quantity": 1.0, "bought_at": start}
+            for uid in uids for coin in COINS
+        ])
+        connection.execute(models.PortfolioAggregates.__table__.insert(), [
+            {"user_id": uid, "token_id": coin["uuid"], "token_name": coin["name"], "token_symbol": coin["symbol"], "quantity": 1.0, "net_cost": 10.0, "buy_cost": 10.0, "buy_quantity": 1.0, "realized_pl": 0.0}
+            for uid in uids for coin in COINS
+        ])
+
+    batch_size = 50000
+    for offset in range(0, rows, batch_size):
+        crypto, fiat = [], []
+        for i in range(offset, min(rows, offset + batch_size)):
+            coin = random.choice(COINS)
+            when = start + timedelta(seconds=i * 7)
+            uid = random.choice(uids)
+            crypto.append({"user_id": uid, "transaction_type": random.choice(["BUY", "SELL"]), "token_id": coin["uuid"], "token_name": coin["name"], "token_symbol": coin["symbol"], "token_price": random.uniform(1, 100), "quantity": random.uniform(0.01, 1), "transaction_time": when})
+            if i % 4 == 0:
+                fiat.append({"user_id": uid, "transaction_type": "Deposit", "quantity": 100.0, "transaction_time": when})
+        with engine.begin() as connection:
+            connection.execute(models.CryptoTransactions.__table__.insert(), crypto)
+            if fiat:
+                connection.execute(models.AccountTransactions.__table__.insert(), fiat)
+
+    return uids
+
+
+def drop_secondary_indexes(engine, Base):
+    from sqlalchemy import inspect
+
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            existing = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    index.drop(connection)
+
+
+def explain(connection, stmt):
+    from sqlalchemy import text
+
+    sql = str(stmt.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+    return [" ".join(str(value) for value in row) for row in connection.execute(text(prefix + sql))]
+
+
+def measure(engine, models, uids, samples):
+    results = {}
+    picks = [(random.choice(uids), random.choice(COINS)["uuid"]) for _ in range(samples)]
+
+    with engine.connect() as connection:
+        plans = {name: explain(connection, stmt) for name, stmt in endpoint_queries(models, *picks[0]).items()}
+
+        timings = {name: [] for name in plans}
+        for uid, token_id in picks:
+            for name, stmt in endpoint_queries(models, uid, token_id).items():
+                started = time.perf_counter()
+                connection.execute(stmt).all()
+                timings[name].append(time.perf_counter() - started)
+
+    for name, samples_ in timings.items():
+        samples_.sort()
+        results[name] = {
+            "plan": plans[name],
+            "p50_ms": statistics.median(samples_) * 1000,
+            "p99_ms": samples_[max(0, int(len(samples_) * 0.99) - 1)] * 1000,
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=1000000, help="synthetic crypto transactions")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASEURL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "plans.db"))
+
+    from Database import models
+    from Database.migrations import migrate
+    from Database.sql import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    drop_secondary_indexes(engine, Base)
+
+    started = time.perf_counter()
+    uids = seed(engine, models, args.users, args.rows)
+    print(f"seeded {args.rows} transactions for {args.users} users in {time.perf_counter() - started:.1f}s")
+
+    before = measure(engine, models, uids, args.samples)
+    started = time.perf_counter()
+    migrate(engine)
+    print(f"migration took {time.perf_counter() - started:.1f}s")
+    after = measure(engine, models, uids, args.samples)
+
+    print(f"{'query':<26} {'p50 before':>11} {'p50 after':>10} {'p99 before':>11} {'p99 after':>10}")
+    for name in before:
+        print(f"{name:<26} {before[name]['p50_ms']:>11.2f} {after[name]['p50_ms']:>10.2f} {before[name]['p99_ms']:>11.2f} {after[name]['p99_ms']:>10.2f}")
+    for name in before:
+        print(f"\n{name}\n  before: {' | '.join(before[name]['plan'])}\n  after:  {' | '.join(after[name]['plan'])}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"database": engine.dialect.name, "users": args.users, "rows": args.rows, "before": before, "after": after}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Worker start time (import + startup events + first response) and peak RSS,
+# each measured in a fresh interpreter. "eager" reproduces the old behaviour of
+# importing the analytics stack and creating the schema at import time.
+#
+#   python -m benchmarks.bench_startup --runs 5
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+WORKER = r"""
+import json, os, resource, sys, time
+started = time.perf_counter()
+if sys.argv[1] == "eager":
+    import numpy, pandas, yfinance
+    from sklearn.preprocessing import MinMaxScaler
+    from Database import models
+    from Database.sql import engine
+    models.Base.metadata.create_all(bind=engine)
+import main
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    client.get("/")
+    elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def measure(mode, env):
+    output = subprocess.run([sys.executable, "-c", WORKER, mode], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("DATABASEURL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup.db"))
+    env["VOLATILITY_REFRESH_SECONDS"] = "0"
+    env["PYTHONPATH"] = os.getcwd() + os.pathsep + env.get("PYTHONPATH", "")
+
+    print(f"{'mode':<8} {'start (ms)':>11} {'max RSS (MB)':>13}")
+    for mode in ("eager", "lazy"):
+        samples = [measure(mode, env) for _ in range(args.runs)]
+        seconds = statistics.median(sample["seconds"] for sample in samples)
+        rss = statistics.median(sample["max_rss_mb"] for sample in samples)
+        print(f"{mode:<8} {seconds * 1000:>11.0f} {rss:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Cold (open + unpickle per request, the old behaviour) versus warm (loaded
+# once in the ModelRegistry) latency of a stress model prediction.
+#
+#   python -m benchmarks.bench_stress_model --model stress_model.pkl
+import argparse
+import os
+import pickle
+import statistics
+import tempfile
+import time
+
+from model_registry import ModelRegistry
+
+
+def synthetic_model(path):
+    import numpy as np
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    features = rng.random((2000, 3)) * [200, 1, 50]
+    labels = (features[:, 0] / 200 + features[:, 1] > 1).astype(int)
+    clf = RandomForestClassifier(n_estimators=100, random_state=0).fit(features, labels)
+
+    with open(path, 'wb') as f:
+        pickle.dump(clf, f)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.99) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", help="pickled classifier; a synthetic RandomForest is used if omitted")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    path = args.model
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "stress_model.pkl")
+        synthetic_model(path)
+
+    row = [[12, 0.4, 3.5]]
+
+    cold = []
+    for _ in range(args.requests):
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            clf = pickle.load(f)
+        clf.predict(row)
+        cold.append(time.perf_counter() - started)
+
+    registry = ModelRegistry(path)
+    registry.load()
+    warm = []
+    for _ in range(args.requests):
+        started = time.perf_counter()
+        registry.predict(row)
+        warm.append(time.perf_counter() - started)
+
+    print(f"model load: {registry.load_seconds * 1000:.1f} ms")
+    print(f"{'':>6} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for name, samples in (("cold", cold), ("warm", warm)):
+        p50, p99 = percentiles(samples)
+        print(f"{name:>6} {p50:>10.2f} {p99:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Trade throughput of buy_crypto/sell_crypto at increasing concurrency, against
+# a local SQLite file (or DATABASEURL) and a stub coinranking server with
+# fixed latency.
+#
+#   python -m benchmarks.bench_trade_concurrency --concurrency 1 4 16 64
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import date
+
+from benchmarks.stubs import COINS, start_coinranking_stub
+
+
+async def run_level(client, uids, concurrency, trades):
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def round_trip(i):
+        # Each task buys and then sells the same token for one user
+        nonlocal failures
+        uid = uids[i % len(uids)]
+        token_id = COINS[i % len(COINS)]["uuid"]
+        async with semaphore:
+            for side in ("buy_crypto", "sell_crypto"):
+                response = await client.post(f"/users/{uid}/{side}", params={"token_id": token_id, "quantity": 0.01})
+                if response.status_code != 200 or response.json().get("status") != "Success":
+                    failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[round_trip(i) for i in range(trades // 2)])
+    return trades / (time.perf_counter() - started), failures
+
+
+async def run(args):
+    import httpx
+    import main
+    from Database import models
+    from Database.migrations import migrate
+    from Database.sql import SessionLocal, engine
+
+    migrate(engine)
+
+    with SessionLocal() as db:
+        uids = [f"bench-{i}" for i in range(args.users)]
+        for uid in uids:
+            db.add(models.User(uid=uid, First_Name="Bench", Last_Name="User", Email=f"{uid}@example.com", Current_Balance=1e12, Account_Status=1, created_date=date.today()))
+        db.commit()
+
+    async with httpx.AsyncClient(app=main.app, base_url="http://bench") as client:
+        print(f"{'concurrency':>12} {'trades/s':>10} {'failed':>7}")
+        for concurrency in args.concurrency:
+            throughput, failures = await run_level(client, uids, concurrency, args.trades)
+            print(f"{concurrency:>12} {throughput:>10.1f} {failures:>7}")
+
+    await main.price_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--trades", type=int, default=200)
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--upstream-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    base_url, _ = start_coinranking_stub(latency=args.upstream_latency)
+    os.environ.setdefault("DATABASEURL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+    os.environ["COINRANKING_BASE_URL"] = base_url
+    os.environ["PRICE_CACHE_SECONDS"] = "0"
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Per-user latency of /users/{uid}/crypto_transactions_info: the old
+# per-row moving-average/sell lookups versus the single-pass cost basis engine.
+#
+#   python -m benchmarks.bench_transactions_info --sizes 100 500 2000
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASEURL", "sqlite://")
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from Database import models
+from Database.sql import engine
+from cost_basis import transactions_info
+
+TOKENS = [("Qwsogvtv82FCd", "Bitcoin", "BTC"), ("razxDUgYGNAdQ", "Ethereum", "ETH"), ("a91GCGd_u96cF", "Dogecoin", "DOGE")]
+
+
+def legacy_transactions_info(uid, db):
+    transactions = db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid).all()
+
+    transaction_info = []
+    for transaction in transactions:
+        transaction_data = {"Average Buying Price": None, "Realized P/L": None, "Realized P/L (%)": None}
+
+        moving_average_price_query = db.query(func.sum(models.CryptoTransactions.token_price * models.CryptoTransactions.quantity) / func.sum(models.CryptoTransactions.quantity)).filter(
+            models.CryptoTransactions.user_id == uid,
+            models.CryptoTransactions.token_name == transaction.token_name,
+            models.CryptoTransactions.transaction_type == "BUY",
+            models.CryptoTransactions.transaction_time <= transaction.transaction_time
+        ).first()
+
+        if moving_average_price_query[0] is not None:
+            transaction_data["Average Buying Price"] = moving_average_price_query[0]
+
+        sell_transaction = db.query(models.CryptoTransactions).filter(
+            models.CryptoTransactions.user_id == uid,
+            models.CryptoTransactions.token_name == transaction.token_name,
+            models.CryptoTransactions.transaction_type == "SELL",
+            models.CryptoTransactions.transaction_time == transaction.transaction_time
+        ).first()
+
+        if sell_transaction and moving_average_price_query[0] is not None:
+            buy_amount = moving_average_price_query[0] * sell_transaction.quantity
+            transaction_data["Realized P/L"] = sell_transaction.quantity * sell_transaction.token_price - buy_amount
+
+        transaction_info.append(transaction_data)
+
+    return transaction_info
+
+
+def single_pass_transactions_info(uid, db):
+    transactions = db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid).order_by(models.CryptoTransactions.transaction_time, models.CryptoTransactions.transaction_id).yield_per(1000)
+
+    return list(transactions_info(transactions))
+
+
+def seed(db, uid, n):
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(n):
+        token_id, name, symbol = random.choice(TOKENS)
+        rows.append(dict(user_id=uid, transaction_type="BUY" if i % 3 else "SELL", token_id=token_id, token_name=name, token_symbol=symbol,
+                         token_price=random.uniform(1, 100), quantity=random.uniform(0.1, 2), transaction_time=start + timedelta(minutes=i)))
+    db.bulk_insert_mappings(models.CryptoTransactions, rows)
+    db.commit()
+
+
+def timed(fn, uid, db, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        db.expunge_all()
+        started = time.perf_counter()
+        fn(uid, db)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 2000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+
+    print(f"{'rows':>8} {'legacy (ms)':>14} {'single pass (ms)':>18} {'speedup':>9}")
+    with Session(engine) as db:
+        for n in args.sizes:
+            uid = f"bench-{n}"
+            seed(db, uid, n)
+            legacy = timed(legacy_transactions_info, uid, db, args.repeat)
+            single_pass = timed(single_pass_transactions_info, uid, db, args.repeat)
+            print(f"{n:>8} {legacy * 1000:>14.1f} {single_pass * 1000:>18.1f} {legacy / single_pass:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
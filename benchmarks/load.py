@@ -0,0 +1,313 @@
+# End-to-end load test of the API: seeds a database, stubs coinranking and
+# the yfinance closes, drives a weighted mix of endpoints at a fixed number
+# of concurrent clients and writes throughput and p50/p95/p99 per endpoint
+# to a JSON file that `compare` can diff across commits.
+#
+#   python -m benchmarks.load run --users 200 --concurrency 32 --duration 30 --output before.json
+#   python -m benchmarks.load compare before.json after.json --threshold 0.1
+#
+# By default the app runs in-process against a temporary SQLite file (set
+# DATABASEURL to use another database). With --url the requests go to a
+# running server instead; it must use the same DATABASEURL, which is seeded
+# from here, and its own upstream settings.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.stubs import COINS, start_coinranking_stub, write_closes_csv
+
+DEFAULT_MIX = "buy=20,sell=10,deposit=10,withdraw=5,balance=15,holdings=15,history=15,portfolio=5,stress=5"
+
+
+# One request per operation; returns the response
+OPERATIONS = {
+    "buy": lambda client, uid, rng: client.post(f"/users/{uid}/buy_crypto", params={"token_id": rng.choice(COINS)["uuid"], "quantity": 0.001}),
+    "sell": lambda client, uid, rng: client.post(f"/users/{uid}/sell_crypto", params={"token_id": rng.choice(COINS)["uuid"], "quantity": 0.001}),
+    "deposit": lambda client, uid, rng: client.post("/add_balance", params={"uid": uid, "quantity": "100"}),
+    "withdraw": lambda client, uid, rng: client.post("/withdraw_money", params={"uid": uid, "quantity": "50"}),
+    "balance": lambda client, uid, rng: client.get(f"/users/{uid}/fetch_balance"),
+    "holdings": lambda client, uid, rng: client.get(f"/users/{uid}/crypto_holdings"),
+    "history": lambda client, uid, rng: client.get(f"/users/{uid}/crypto_transactions", params={"limit": 100}),
+    "portfolio": lambda client, uid, rng: client.get(f"/users/{uid}/portfolio"),
+    "stress": lambda client, uid, rng: client.get(f"/users/{uid}/calculate_stress_metric"),
+}
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_samples, p):
+    # Nearest rank
+    if not sorted_samples:
+        return None
+    index = max(0, min(len(sorted_samples) - 1, int(round(p / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[index]
+
+
+def summarize(samples, errors, rejected, accepted, seconds):
+    samples = sorted(samples)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "rejected": rejected,
+        "accepted": accepted,
+        "throughput": len(samples) / seconds if seconds else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000 if samples else None,
+        "p95_ms": percentile(samples, 95) * 1000 if samples else None,
+        "p99_ms": percentile(samples, 99) * 1000 if samples else None,
+        "max_ms": samples[-1] * 1000 if samples else None,
+    }
+
+
+async def drive(client, uids, weights, concurrency, duration, warmup, seed):
+    names = list(weights)
+    name_weights = list(weights.values())
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    # 200 responses the app turned down, e.g. a sell without holdings
+    rejected = {name: 0 for name in names}
+    # 202s: handed to the analytics pool, result not ready yet
+    accepted = {name: 0 for name in names}
+
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    async def worker(i):
+        rng = random.Random(seed + i)
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                return
+            name = rng.choices(names, weights=name_weights)[0]
+            uid = rng.choice(uids)
+
+            started = time.perf_counter()
+            try:
+                response = await OPERATIONS[name](client, uid, rng)
+                failed = response.status_code >= 400
+                body = response.json() if not failed and response.headers.get("content-type", "").startswith("application/json") else None
+                declined = isinstance(body, dict) and body.get("status") == "Failed"
+                pending = response.status_code == 202
+            except Exception:
+                failed, declined, pending = True, False, False
+            elapsed = time.perf_counter() - started
+
+            if started < measure_from:
+                continue
+            latencies[name].append(elapsed)
+            errors[name] += failed
+            rejected[name] += declined
+            accepted[name] += pending
+
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    seconds = time.perf_counter() - measure_from
+
+    endpoints = {name: summarize(latencies[name], errors[name], rejected[name], accepted[name], seconds) for name in names}
+    total = summarize([sample for samples in latencies.values() for sample in samples], sum(errors.values()), sum(rejected.values()), sum(accepted.values()), seconds)
+    return total, endpoints
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def prepare_environment(args, workdir):
+    # Must run before main and Database.sql are imported
+    os.environ.setdefault("DATABASEURL", "sqlite:///" + os.path.join(workdir, "load.db"))
+
+    if args.url is None:
+        base_url, _ = start_coinranking_stub(latency=args.upstream_latency)
+        os.environ["COINRANKING_BASE_URL"] = base_url
+
+        from volatility import TICKERS
+        os.environ["VOLATILITY_SOURCE_CSV"] = write_closes_csv(os.path.join(workdir, "closes.csv"), TICKERS)
+
+        if "STRESS_MODEL_PATH" not in os.environ:
+            # Set before the import: bench_stress_model imports model_registry,
+            # which reads STRESS_MODEL_PATH once
+            os.environ["STRESS_MODEL_PATH"] = os.path.join(workdir, "stress_model.pkl")
+            from benchmarks.bench_stress_model import synthetic_model
+            synthetic_model(os.environ["STRESS_MODEL_PATH"])
+
+
+def seed_database(args):
+    from Database.migrations import migrate
+    from Database.sql import SessionLocal, engine
+    from benchmarks.seed import USER_PREFIX, seed
+    from volatility import default_source, refresh_volatility
+
+    if args.skip_seed:
+        # Reuse the users a previous run seeded into DATABASEURL
+        return [f"{USER_PREFIX}{i}" for i in range(args.users)], engine.dialect.name
+
+    migrate(engine)
+    with SessionLocal() as db:
+        started = time.perf_counter()
+        uids = seed(db, args.users, args.trades_per_user, seed=args.seed)
+        if args.url is None:
+            refresh_volatility(db, default_source())
+        print(f"Seeded {len(uids)} users x {args.trades_per_user} trades in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    return uids, engine.dialect.name
+
+
+async def run_workload(args, uids):
+    import httpx
+
+    weights = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    if args.url is not None:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+            return await drive(client, uids, weights, args.concurrency, args.duration, args.warmup, args.seed)
+
+    import main
+
+    # Startup/shutdown events: price client, price stream, analytics pool, volatility refresh
+    await main.app.router.startup()
+    try:
+        async with httpx.AsyncClient(app=main.app, base_url="http://load", limits=limits, timeout=60) as client:
+            return await drive(client, uids, weights, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        await main.app.router.shutdown()
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="load-")
+    prepare_environment(args, workdir)
+    uids, dialect = seed_database(args)
+
+    total, endpoints = asyncio.run(run_workload(args, uids))
+
+    commit = git_commit()
+    result = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "target": args.url or "in-process",
+            "database": dialect,
+            "python": platform.python_version(),
+            "users": args.users,
+            "trades_per_user": args.trades_per_user,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": parse_mix(args.mix),
+            "upstream_latency": args.upstream_latency,
+        },
+        "total": total,
+        "endpoints": endpoints,
+    }
+
+    output = args.output or f"load-{commit}.json"
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print_report(total, endpoints)
+    print(f"\nWrote {output}")
+
+
+def format_ms(value):
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def print_report(total, endpoints):
+    print(f"{'endpoint':<12} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'rejected':>9} {'202':>5}")
+    for name, stats in list(endpoints.items()) + [("total", total)]:
+        print(f"{name:<12} {stats['requests']:>9} {stats['throughput']:>8.1f} {format_ms(stats['p50_ms']):>8} {format_ms(stats['p95_ms']):>8} {format_ms(stats['p99_ms']):>8} {stats['errors']:>7} {stats['rejected']:>9} {stats['accepted']:>5}")
+
+
+def change(before, after):
+    if before is None or after is None or before == 0:
+        return None
+    return (after - before) / before
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{before['meta']['commit']} -> {after['meta']['commit']}")
+    print(f"{'endpoint':<12} {'req/s':>18} {'p95 ms':>22} {'p99 ms':>22}")
+
+    regressions = []
+    rows = [(name, before["endpoints"].get(name), stats) for name, stats in after["endpoints"].items()]
+    rows.append(("total", before["total"], after["total"]))
+
+    for name, old, new in rows:
+        if old is None:
+            print(f"{name:<12} (new)")
+            continue
+
+        throughput = change(old["throughput"], new["throughput"])
+        p95 = change(old["p95_ms"], new["p95_ms"])
+        p99 = change(old["p99_ms"], new["p99_ms"])
+
+        def cell(old_value, new_value, delta, fmt):
+            text = f"{fmt(old_value)}->{fmt(new_value)}"
+            return f"{text} ({delta:+.0%})" if delta is not None else text
+
+        print(f"{name:<12} {cell(old['throughput'], new['throughput'], throughput, lambda v: f'{v:.0f}'):>18} "
+              f"{cell(old['p95_ms'], new['p95_ms'], p95, format_ms):>22} {cell(old['p99_ms'], new['p99_ms'], p99, format_ms):>22}")
+
+        if throughput is not None and throughput < -args.threshold:
+            regressions.append(f"{name} throughput {throughput:+.0%}")
+        if p95 is not None and p95 > args.threshold:
+            regressions.append(f"{name} p95 {p95:+.0%}")
+
+    if regressions:
+        print("\nRegressions beyond {:.0%}: {}".format(args.threshold, ", ".join(regressions)))
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed, run the workload and write a result file")
+    run_parser.add_argument("--users", type=int, default=100)
+    run_parser.add_argument("--trades-per-user", type=int, default=50)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    run_parser.add_argument("--warmup", type=float, default=3, help="seconds run before measuring")
+    run_parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight,... from: " + ", ".join(OPERATIONS))
+    run_parser.add_argument("--upstream-latency", type=float, default=0.02, help="seconds added by the coinranking stub")
+    run_parser.add_argument("--url", help="benchmark a running server instead of the app in-process")
+    run_parser.add_argument("--skip-seed", action="store_true", help="reuse the users already seeded into DATABASEURL")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", help="result file, load-<commit>.json by default")
+
+    compare_parser = commands.add_parser("compare", help="diff two result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="exit 1 if p95 rises or throughput drops by more than this fraction")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Fills a database with synthetic users, deposits, trade histories, holdings
+# and portfolio aggregates for the load benchmark.
+#
+#   python -m benchmarks.seed --users 1000 --trades-per-user 200
+import argparse
+import random
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import insert, select
+
+from benchmarks.stubs import COINS
+
+USER_PREFIX = "load-"
+
+
+def user_rows(uids, balance):
+    return [
+        {"uid": uid, "First_Name": "Load", "Last_Name": "User", "Email": f"{uid}@example.com", "Current_Balance": balance, "Account_Status": 1, "created_date": date.today()}
+        for uid in uids
+    ]
+
+
+def history(uid, trades, rng, now, days=180):
+    # Time-ordered buys and sells that never sell more than is held
+    held = {}
+    times = sorted(now - timedelta(seconds=rng.uniform(0, days * 86400)) for _ in range(trades))
+    rows = []
+
+    for transaction_time in times:
+        coin = rng.choice(COINS)
+        price = float(coin["price"]) * rng.uniform(0.7, 1.3)
+        quantity = round(rng.uniform(0.01, 1.0), 4)
+
+        if held.get(coin["uuid"], 0) >= quantity and rng.random() < 0.4:
+            transaction_type = "SELL"
+            held[coin["uuid"]] -= quantity
+        else:
+            transaction_type = "BUY"
+            held[coin["uuid"]] = held.get(coin["uuid"], 0) + quantity
+
+        rows.append({
+            "user_id": uid, "transaction_type": transaction_type,
+            "token_id": coin["uuid"], "token_name": coin["name"], "token_symbol": coin["symbol"],
+            "token_price": price, "quantity": quantity, "transaction_time": transaction_time,
+        })
+
+    return rows, held
+
+
+def seed(db, users=100, trades_per_user=50, deposits_per_user=5, balance=1e12, seed=0, batch_size=5000):
+    # Returns all the uids; users that already exist (e.g. from an earlier
+    # run against the same database) are kept as they are and not reseeded
+    from Database import models
+    from portfolio import rebuild_aggregates
+    from stress import UID_CHUNK_SIZE
+
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    by_id = {coin["uuid"]: coin for coin in COINS}
+    all_uids = [f"{USER_PREFIX}{i}" for i in range(users)]
+
+    existing = set()
+    for i in range(0, len(all_uids), UID_CHUNK_SIZE):
+        existing.update(db.scalars(select(models.User.uid).filter(models.User.uid.in_(all_uids[i:i + UID_CHUNK_SIZE]))))
+    uids = [uid for uid in all_uids if uid not in existing]
+    if not uids:
+        return all_uids
+
+    db.execute(insert(models.User), user_rows(uids, balance))
+
+    transactions, holdings, deposits = [], [], []
+
+    def flush():
+        if transactions:
+            db.execute(insert(models.CryptoTransactions), transactions)
+        if deposits:
+            db.execute(insert(models.AccountTransactions), deposits)
+        transactions.clear()
+        deposits.clear()
+
+    for uid in uids:
+        rows, held = history(uid, trades_per_user, rng, now)
+        transactions.extend(rows)
+        holdings.extend(
+            {"user_id": uid, "token_id": token_id, "token_name": by_id[token_id]["name"], "token_symbol": by_id[token_id]["symbol"], "quantity": quantity, "bought_at": now}
+            for token_id, quantity in held.items()
+        )
+        deposits.extend(
+            {"user_id": uid, "transaction_type": "Deposit", "quantity": round(rng.uniform(10, 10000), 2), "transaction_time": now - timedelta(days=rng.uniform(0, 180))}
+            for _ in range(deposits_per_user)
+        )
+        if len(transactions) >= batch_size:
+            flush()
+
+    flush()
+    if holdings:
+        db.execute(insert(models.CryptoHoldings), holdings)
+    db.commit()
+
+    rebuild_aggregates(db, uids)
+
+    return all_uids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--trades-per-user", type=int, default=50)
+    parser.add_argument("--deposits-per-user", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from Database.migrations import migrate
+    from Database.sql import SessionLocal, engine
+
+    migrate(engine)
+    with SessionLocal() as db:
+        uids = seed(db, args.users, args.trades_per_user, args.deposits_per_user, seed=args.seed)
+    print(f"Seeded {len(uids)} users with {args.trades_per_user} trades each")
+
+
+if __name__ == "__main__":
+    main()
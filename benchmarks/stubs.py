@@ -0,0 +1,66 @@
+# Local stand-ins for the upstream services so benchmarks never leave the machine.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+COINS = [
+    {"uuid": "Qwsogvtv82FCd", "name": "Bitcoin", "symbol": "BTC", "price": "64000.0"},
+    {"uuid": "razxDUgYGNAdQ", "name": "Ethereum", "symbol": "ETH", "price": "3100.0"},
+    {"uuid": "a91GCGd_u96cF", "name": "Dogecoin", "symbol": "DOGE", "price": "0.15"},
+    {"uuid": "WcwrkfNI4FUAe", "name": "BNB", "symbol": "BNB", "price": "580.0"},
+    {"uuid": "-l8Mn2pVlRs-p", "name": "XRP", "symbol": "XRP", "price": "0.52"},
+]
+
+
+def start_coinranking_stub(latency=0.0, coins=COINS):
+    # Serves /coins and /coin/{uuid} like coinranking; returns (base_url, server)
+    by_id = {coin["uuid"]: coin for coin in coins}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+
+            url = urlsplit(self.path)
+            path = url.path
+            if path == "/coins":
+                uuids = parse_qs(url.query).get("uuids[]")
+                coins = [by_id[uuid] for uuid in uuids if uuid in by_id] if uuids else list(by_id.values())
+                body = {"status": "success", "data": {"coins": coins}}
+            elif path.startswith("/coin/") and path[len("/coin/"):] in by_id:
+                body = {"status": "success", "data": {"coin": by_id[path[len("/coin/"):]]}}
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def write_closes_csv(path, tickers, days=120, seed=0):
+    # Random-walk daily closes in the layout volatility.CSVSource reads, ending today
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=pd.Timestamp.today().normalize(), periods=days, freq="D")
+    returns = rng.normal(0, 0.03, size=(days, len(tickers)))
+    closes = pd.DataFrame(100 * np.cumprod(1 + returns, axis=0), index=dates, columns=tickers)
+    closes.to_csv(path)
+
+    return path
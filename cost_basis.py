@@ -0,0 +1,57 @@
+from datetime import datetime
+from itertools import groupby
+
+
+class TokenPosition:
+    def __init__(self):
+        self.buy_cost = 0.0
+        self.buy_quantity = 0.0
+
+    @property
+    def average_buying_price(self):
+        if self.buy_quantity == 0:
+            return None
+        return self.buy_cost / self.buy_quantity
+
+
+def transactions_info(transactions):
+    # Walk the user's transactions once, in transaction_time order, and keep a
+    # running cost basis per token instead of re-querying the history per row.
+    positions = {}
+
+    for _, same_time in groupby(transactions, key=lambda t: t.transaction_time):
+        same_time = list(same_time)
+
+        # Buys sharing a timestamp count towards each other's average price
+        for transaction in same_time:
+            if transaction.transaction_type == "BUY":
+                position = positions.setdefault(transaction.token_name, TokenPosition())
+                position.buy_cost += transaction.token_price * transaction.quantity
+                position.buy_quantity += transaction.quantity
+
+        for transaction in same_time:
+            position = positions.get(transaction.token_name)
+            average_price = position.average_buying_price if position else None
+
+            transaction_data = {
+                "Cryptocurrency Name": transaction.token_name,
+                "Transaction Type": transaction.transaction_type,
+                "Average Buying Price": average_price,
+                "Date": datetime.fromisoformat(transaction.transaction_time.isoformat()),
+                "Quantity": transaction.quantity,
+                "Price": transaction.token_price,
+                "Amount": transaction.quantity * transaction.token_price,
+                "Realized P/L": None,
+                "Realized P/L (%)": None
+            }
+
+            if transaction.transaction_type == "SELL":
+                buy_amount = average_price * transaction.quantity if average_price is not None else 0
+                sell_amount = transaction.quantity * transaction.token_price
+                realized_pl = sell_amount - buy_amount
+                realized_pl_percentage = (float(realized_pl) / float(buy_amount)) * 100 if buy_amount != 0 else 0
+
+                transaction_data["Realized P/L"] = realized_pl
+                transaction_data["Realized P/L (%)"] = round(realized_pl_percentage, 6)
+
+            yield transaction_data
@@ -0,0 +1,270 @@
+# Columnar export of transaction history. Rows are streamed from a
+# server-side cursor into Arrow record batches and written out as an Arrow
+# IPC stream or Parquet, one batch at a time, so a full-history pull never
+# holds more than EXPORT_BATCH_SIZE rows in memory.
+#
+#   python export.py export crypto trades.parquet --start 2024-01-01 --uid <uid> ...
+#   python export.py aggregate trades.parquet --output pl.parquet
+#   python export.py aggregate --uid <uid> ...      (straight from the database)
+#
+# pyarrow and pandas are imported inside the functions that use them.
+import argparse
+import os
+from datetime import datetime
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import DateTime, Float, Integer, select
+
+from Database import models
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "50000"))
+
+EXPORT_TABLES = {
+    "crypto": models.CryptoTransactions,
+    "fiat": models.AccountTransactions,
+}
+
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def arrow_type(column):
+    import pyarrow as pa
+
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us", tz="UTC" if column.type.timezone else None)
+    return pa.string()
+
+def export_schema(model):
+    import pyarrow as pa
+
+    return pa.schema([pa.field(column.name, arrow_type(column)) for column in model.__table__.columns])
+
+def export_query(model, uids=None, start=None, end=None):
+    # Ordered by user and time, which aggregate_batches relies on
+    table = model.__table__
+    query = select(table).order_by(table.c.user_id, table.c.transaction_time, table.c.transaction_id)
+    if uids:
+        query = query.filter(table.c.user_id.in_(uids))
+    if start is not None:
+        query = query.filter(table.c.transaction_time >= start)
+    if end is not None:
+        query = query.filter(table.c.transaction_time < end)
+    return query
+
+def record_batches(db, model, uids=None, start=None, end=None, batch_size=EXPORT_BATCH_SIZE):
+    import pyarrow as pa
+
+    schema = export_schema(model)
+    result = db.execute(export_query(model, uids, start, end).execution_options(yield_per=batch_size))
+
+    for rows in result.partitions():
+        columns = list(zip(*rows))
+        yield pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+
+class ChunkSink:
+    # File-like object that keeps what the writer wrote until it is taken,
+    # so a response can send each batch as soon as it is encoded
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def open_writer(sink, schema, format):
+    import pyarrow as pa
+
+    if format == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(sink, schema, compression="zstd")
+    return pa.ipc.new_stream(sink, schema)
+
+def encode_batches(batches, schema, format):
+    # Yields the encoded file piece by piece: a Parquet row group or an Arrow
+    # IPC message per batch, then the footer
+    import pyarrow as pa
+
+    sink = ChunkSink()
+    writer = open_writer(pa.PythonFile(sink, mode="w"), schema, format)
+
+    for batch in batches:
+        writer.write_batch(batch)
+        data = sink.take()
+        if data:
+            yield data
+
+    writer.close()
+    yield sink.take()
+
+def export_response(db, table, format="parquet", uids=None, start=None, end=None):
+    # The session from get_db stays open until the response has been sent
+    model = EXPORT_TABLES[table]
+    batches = record_batches(db, model, uids, start, end)
+    filename = f"{model.__tablename__}.{'parquet' if format == 'parquet' else 'arrows'}"
+
+    return StreamingResponse(
+        encode_batches(batches, export_schema(model), format),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+def trade_aggregates_frame(frame):
+    # Per user and token: trades, bought and sold quantity and value, and the
+    # realized P/L against the running average buying price, computed the
+    # same way as portfolio.compute_aggregates but with whole-column
+    # operations. frame holds complete, time-ordered histories.
+    import numpy as np
+
+    sell = (frame["transaction_type"] == "SELL").to_numpy()
+    quantity = frame["quantity"].to_numpy(dtype=float)
+    amount = frame["token_price"].to_numpy(dtype=float) * quantity
+
+    buy_quantity = np.where(sell, 0.0, quantity)
+    buy_value = np.where(sell, 0.0, amount)
+
+    keys = [frame["user_id"], frame["token_id"]]
+    frame = frame.assign(buy_quantity=buy_quantity, buy_value=buy_value, sell_quantity=np.where(sell, quantity, 0.0), sell_value=np.where(sell, amount, 0.0))
+
+    # A sell adds nothing to the running buy totals, so on sell rows these
+    # are the totals before the sell
+    cumulative_cost = frame.groupby(keys, sort=False, dropna=False)["buy_value"].cumsum().to_numpy()
+    cumulative_quantity = frame.groupby(keys, sort=False, dropna=False)["buy_quantity"].cumsum().to_numpy()
+    average_price = np.divide(cumulative_cost, cumulative_quantity, out=np.zeros_like(cumulative_cost), where=cumulative_quantity != 0)
+
+    frame = frame.assign(realized_pl=np.where(sell, amount - quantity * average_price, 0.0), trades=1)
+
+    return frame.groupby(["user_id", "token_id"], sort=False, dropna=False).agg(
+        token_symbol=("token_symbol", "last"),
+        trades=("trades", "sum"),
+        buy_quantity=("buy_quantity", "sum"),
+        sell_quantity=("sell_quantity", "sum"),
+        buy_value=("buy_value", "sum"),
+        sell_value=("sell_value", "sum"),
+        realized_pl=("realized_pl", "sum"),
+    ).reset_index()
+
+def aggregate_batches(batches):
+    # Aggregates crypto transaction batches ordered by user and time. The last
+    # user of each batch may continue in the next one, so their rows are held
+    # back until the batch after has been seen.
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    results = []
+    pending = None
+
+    for batch in batches:
+        table = pa.Table.from_batches([batch])
+        if pending is not None:
+            table = pa.concat_tables([pending, table])
+        if table.num_rows == 0:
+            continue
+
+        last = table["user_id"][-1]
+        if last.is_valid:
+            last_user = pc.fill_null(pc.equal(table["user_id"], last), False)
+        else:
+            last_user = pc.is_null(table["user_id"])
+        pending = table.filter(last_user)
+        ready = table.filter(pc.invert(last_user))
+        if ready.num_rows:
+            results.append(trade_aggregates_frame(ready.to_pandas()))
+
+    if pending is not None and pending.num_rows:
+        results.append(trade_aggregates_frame(pending.to_pandas()))
+
+    if not results:
+        return trade_aggregates_frame(export_schema(models.CryptoTransactions).empty_table().to_pandas())
+    return pd.concat(results, ignore_index=True)
+
+def file_batches(path, batch_size=EXPORT_BATCH_SIZE):
+    # Batches from a file written by `export`, Parquet or Arrow IPC stream
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+
+    if magic == b"PAR1":
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+    else:
+        with pa.ipc.open_stream(path) as reader:
+            yield from reader
+
+def parse_time(value):
+    return datetime.fromisoformat(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export transaction history and aggregate trades")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="write transactions to a Parquet or Arrow file")
+    export_parser.add_argument("table", choices=sorted(EXPORT_TABLES))
+    export_parser.add_argument("output")
+    export_parser.add_argument("--format", choices=sorted(MEDIA_TYPES), default="parquet")
+
+    aggregate_parser = commands.add_parser("aggregate", help="P/L and volume per user and token")
+    aggregate_parser.add_argument("input", nargs="?", help="file written by export (without --start); read from the database if omitted")
+    aggregate_parser.add_argument("--output", help="write the aggregates to this Parquet file instead of printing them")
+
+    for command in (export_parser, aggregate_parser):
+        # Filters apply to what is read from the database
+        command.add_argument("--uid", action="append", dest="uids", help="only these users, repeatable")
+        command.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+
+    # Only for export: realized P/L needs every buy before a sell, so the
+    # aggregates are always computed over complete histories
+    export_parser.add_argument("--start", type=parse_time, help="transaction_time from, inclusive")
+    export_parser.add_argument("--end", type=parse_time, help="transaction_time until, exclusive")
+
+    args = parser.parse_args()
+
+    if args.command == "aggregate" and args.input:
+        aggregates = aggregate_batches(file_batches(args.input, args.batch_size))
+    else:
+        from Database.sql import SessionLocal
+
+        with SessionLocal() as db:
+            if args.command == "export":
+                model = EXPORT_TABLES[args.table]
+                with open(args.output, "wb") as f:
+                    for data in encode_batches(record_batches(db, model, args.uids, args.start, args.end, args.batch_size), export_schema(model), args.format):
+                        f.write(data)
+                print(f"Wrote {args.output}")
+                return
+
+            aggregates = aggregate_batches(record_batches(db, models.CryptoTransactions, args.uids, batch_size=args.batch_size))
+
+    if args.output:
+        aggregates.to_parquet(args.output, index=False)
+        print(f"Wrote {len(aggregates)} rows to {args.output}")
+    else:
+        print(aggregates.groupby("token_symbol")[["trades", "buy_value", "sell_value", "realized_pl"]].sum().to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+from sqlalchemy import update
+from sqlalchemy.exc import DBAPIError
+
+from Database import models
+from Database.upsert import dialect_insert
+
+# Attempts per ledger transaction when the database reports a serialization
+# failure, deadlock or (on SQLite) a locked database
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF_SECONDS = 0.01
+
+RETRYABLE_PGCODES = {"40001", "40P01"}
+
+class LedgerConflict(Exception):
+    # A conditional update matched no row because the balance or holdings
+    # changed after they were read; the transaction is retried from scratch
+    pass
+
+# Every write path touches the users row before the holdings row, so two
+# trades for the same user can't deadlock on each other.
+
+def credit_balance(uid, amount):
+    return update(models.User).where(models.User.uid == uid).values(
+        Current_Balance=models.User.Current_Balance + amount
+    ).returning(models.User.Current_Balance).execution_options(synchronize_session=False)
+
+def debit_balance(uid, amount):
+    # Matches no row, and returns nothing, if the balance would go negative
+    return update(models.User).where(models.User.uid == uid, models.User.Current_Balance >= amount).values(
+        Current_Balance=models.User.Current_Balance - amount
+    ).returning(models.User.Current_Balance).execution_options(synchronize_session=False)
+
+def credit_holdings(dialect_name):
+    # Adds to (or creates) holdings; execute with a list of rows to credit many at once
+    table = models.CryptoHoldings.__table__
+    stmt = dialect_insert(dialect_name, table)
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "token_id"],
+        set_={"quantity": table.c.quantity + stmt.excluded.quantity},
+    )
+
+def credit_holding(dialect_name, uid, token_id, token_name, token_symbol, quantity):
+    table = models.CryptoHoldings.__table__
+    return credit_holdings(dialect_name).values(user_id=uid, token_id=token_id, token_name=token_name, token_symbol=token_symbol, quantity=quantity).returning(table.c.quantity)
+
+def debit_holding(uid, token_id, quantity):
+    # Matches no row if the user doesn't hold enough of the token
+    return update(models.CryptoHoldings).where(
+        models.CryptoHoldings.user_id == uid,
+        models.CryptoHoldings.token_id == token_id,
+        models.CryptoHoldings.quantity >= quantity,
+    ).values(quantity=models.CryptoHoldings.quantity - quantity).returning(models.CryptoHoldings.quantity).execution_options(synchronize_session=False)
+
+def is_retryable(error):
+    pgcode = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    if pgcode in RETRYABLE_PGCODES:
+        return True
+    return "database is locked" in str(error.orig)
+
+def run_with_retry(db, work):
+    # work() runs one whole transaction, commit included, and may be re-run
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return work()
+        except LedgerConflict:
+            db.rollback()
+            if attempt == MAX_ATTEMPTS:
+                raise
+        except DBAPIError as e:
+            db.rollback()
+            if attempt == MAX_ATTEMPTS or not is_retryable(e):
+                raise
+        time.sleep(RETRY_BACKOFF_SECONDS * attempt)
+
+async def run_with_retry_async(db, work):
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return await work()
+        except LedgerConflict:
+            await db.rollback()
+            if attempt == MAX_ATTEMPTS:
+                raise
+        except DBAPIError as e:
+            await db.rollback()
+            if attempt == MAX_ATTEMPTS or not is_retryable(e):
+                raise
+        await asyncio.sleep(RETRY_BACKOFF_SECONDS * attempt)
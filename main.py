@@ -1,26 +1,45 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Body, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import func, update
+from sqlalchemy import func
 
 from Database import models
-from Database.sql import engine, SessionLocal
-
-from datetime import datetime, timedelta
-import yfinance as yf
-import pandas as pd
-import numpy as np
-import pickle
-from sklearn.preprocessing import MinMaxScaler
-
-import httpx
+from Database.sql import engine, async_engine, SessionLocal, AsyncSessionLocal
+
+from Database.prices import store_snapshot, latest_prices_query
+from Database.schema import Order
+
+from cost_basis import transactions_info
+from export import EXPORT_TABLES, export_response
+from ledger import LedgerConflict, credit_balance, credit_holding, debit_balance, debit_holding, run_with_retry, run_with_retry_async
+from orders import MAX_BATCH_ORDERS, execute_orders
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset, ndjson_response, page
+from portfolio import trade_statement
+from stress import latest_volatility_date
+from volatility import WINDOW_DAYS
+
+from datetime import datetime
+from typing import List, Optional
+import asyncio
+import json
+import os
+
+import metrics
+from metrics import run_in_threadpool
+from analytics import VOLATILITY, AnalyticsPool, volatility_job
+from model_registry import stress_model
+from price_client import PriceClient
+from response_cache import ResponseCache
+from streaming import PriceStream
 # from Database.schema import CabBase, CabsResponse, DriversResponse, DriverBase, DeleteResponse, SearchRequest
 
 # from Database.validation import validateDriver, validateCab, validateEmail
 
-models.Base.metadata.create_all(bind=engine)
+# The schema is created and upgraded by `python -m Database.migrations`, not at import
 
 app = FastAPI(title="Hack Crypto Api")
 
@@ -34,6 +53,122 @@ app.add_middleware(
     allow_credentials=True,
 )
 
+metrics.install(app)
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+
+def stress_model_metrics_lines():
+    # Summed over the analytics workers, which are the processes that predict
+    model_metrics = analytics_pool.model_metrics()
+    return (metrics.sample("stress_model_load_seconds", "Time the last stress model load took", "gauge", model_metrics["load_seconds"])
+            + metrics.sample("stress_model_loads_total", "Stress model loads, reloads included", "counter", model_metrics["loads"])
+            + metrics.sample("stress_model_predictions_total", "Stress model predict calls", "counter", model_metrics["predictions"])
+            + metrics.sample("stress_model_predict_seconds_total", "Time spent in stress model predict calls", "counter", model_metrics["predict_seconds"]))
+
+app.state.extra_metrics.append(stress_model_metrics_lines)
+
+response_cache = ResponseCache.from_env()
+
+def response_cache_metrics_lines():
+    cache_stats = response_cache.stats()
+    lines = (metrics.sample("response_cache_hits_total", "Cached user responses served without a query", "counter", cache_stats["hits"])
+             + metrics.sample("response_cache_misses_total", "User responses built from the database", "counter", cache_stats["misses"])
+             + metrics.sample("response_cache_not_modified_total", "Polls answered with 304 Not Modified", "counter", cache_stats["not_modified"]))
+    if cache_stats["entries"] is not None:
+        lines += metrics.sample("response_cache_entries", "Cached user responses", "gauge", cache_stats["entries"])
+    if cache_stats["memory_bytes"] is not None:
+        lines += metrics.sample("response_cache_memory_bytes", "Memory used by cached response bodies", "gauge", cache_stats["memory_bytes"])
+    return lines
+
+app.state.extra_metrics.append(response_cache_metrics_lines)
+
+price_client = PriceClient(on_request=metrics.observe_upstream)
+
+@app.on_event("startup")
+async def start_price_client():
+    await price_client.start()
+
+@app.on_event("shutdown")
+async def close_price_client():
+    await price_client.close()
+
+# One upstream poll per interval for every streaming client of this worker
+price_stream = PriceStream(price_client, AsyncSessionLocal)
+
+@app.on_event("startup")
+async def start_price_stream():
+    price_stream.start()
+
+@app.on_event("shutdown")
+async def stop_price_stream():
+    await price_stream.stop()
+
+def price_stream_metrics_lines():
+    stream_stats = price_stream.stats()
+    return (metrics.sample("price_stream_subscribers", "Connected price stream clients", "gauge", stream_stats["subscribers"])
+            + metrics.sample("price_stream_polls_total", "Upstream polls made by the price stream", "counter", stream_stats["polls"]))
+
+app.state.extra_metrics.append(price_stream_metrics_lines)
+
+# "startup" loads the model (and sklearn) before serving, e.g. to share it
+# between workers forked with --preload; by default it is warmed in the
+# background so startup doesn't wait for the scientific stack
+STRESS_MODEL_PRELOAD = os.getenv("STRESS_MODEL_PRELOAD", "background")
+
+def load_stress_model():
+    try:
+        stress_model.load()
+    except FileNotFoundError:
+        print("Stress model not found at", stress_model.path)
+
+# Stress predictions and volatility refreshes run in the analytics pool,
+# see analytics.py
+analytics_pool = AnalyticsPool.from_env()
+
+@app.on_event("shutdown")
+async def stop_analytics_pool():
+    analytics_pool.shutdown()
+
+def analytics_metrics_lines():
+    analytics_stats = analytics_pool.stats()
+    return (metrics.sample("analytics_jobs_pending", "Analytics jobs queued or running", "gauge", analytics_stats["pending"])
+            + metrics.sample("analytics_jobs_submitted_total", "Analytics jobs submitted", "counter", analytics_stats["submitted"])
+            + metrics.sample("analytics_jobs_failed_total", "Analytics jobs that raised", "counter", analytics_stats["failed"])
+            + metrics.sample("analytics_stored_results_total", "Stress metrics served from analytics_results", "counter", analytics_stats["stored_hits"]))
+
+app.state.extra_metrics.append(analytics_metrics_lines)
+
+@app.on_event("startup")
+async def warm_stress_model():
+    # Pool workers load their own copy; only the inline backend predicts here
+    if not analytics_pool.backend.in_process:
+        return
+    if STRESS_MODEL_PRELOAD == "startup":
+        load_stress_model()
+    elif STRESS_MODEL_PRELOAD == "background":
+        app.state.stress_model_warmup = asyncio.create_task(run_in_threadpool(load_stress_model))
+
+VOLATILITY_REFRESH_SECONDS = float(os.getenv("VOLATILITY_REFRESH_SECONDS", "3600"))
+
+async def refresh_volatility_periodically():
+    while True:
+        try:
+            await analytics_pool.run(VOLATILITY, volatility_job)
+        except Exception as e:
+            print("Error refreshing volatility index:", str(e))
+        await asyncio.sleep(VOLATILITY_REFRESH_SECONDS)
+
+@app.on_event("startup")
+async def start_volatility_refresh():
+    if VOLATILITY_REFRESH_SECONDS > 0:
+        app.state.volatility_refresh = asyncio.create_task(refresh_volatility_periodically())
+
+@app.on_event("shutdown")
+async def stop_volatility_refresh():
+    task = getattr(app.state, "volatility_refresh", None)
+    if task is not None:
+        task.cancel()
+
 def get_db():
     try:
         db = SessionLocal()
@@ -41,21 +176,31 @@ def get_db():
     finally:
         db.close()
 
+# Async endpoints use this one; sync endpoints keep get_db and run in the threadpool
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 @app.get("/users/{uid}", tags=["User"])
-def get_user(uid: str,  db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.uid == uid).first()
+def get_user(uid: str, request: Request,  db: Session = Depends(get_db)):
+    def user():
+        return db.query(models.User).filter(models.User.uid == uid).first()
 
-    return user
+    return response_cache.respond(request, uid, "user", user)
 
 @app.get("/get_users", tags=["Admin"])
-def get_users(db: Session = Depends(get_db)):
-    users = db.query(models.User).all()
+def get_users(response: Response, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), format: str = Query("json", regex="^(json|ndjson)$"), db: Session = Depends(get_db)):
+    columns = (models.User.uid,)
+    users = keyset(db.query(models.User), columns, cursor, descending=False)
+
+    if format == "ndjson":
+        return ndjson_response(users)
 
-    return users
+    return page(users, columns, limit, response)
 
 @app.post("/create_user", tags=["User"])
 def create_user(uid: str, First_Name:str, Last_Name: str, Email: str, Phone: str,  db: Session = Depends(get_db)):
@@ -75,344 +220,380 @@ def create_user(uid: str, First_Name:str, Last_Name: str, Email: str, Phone: str
         print("Error creating user:", str(e))
         raise HTTPException(status_code=500, detail="Error creating user")
 
+    response_cache.invalidate(uid)
+
     return user_object
 
 @app.post("/add_balance", tags=["User"])
 def add_balance(uid: str, quantity : str,  db: Session = Depends(get_db)):
-    
-    user_obj = db.query(models.User).filter_by(uid=uid).first()
+    amount = float(quantity)
 
-    user_obj.Current_Balance += float(quantity)
+    def deposit():
+        balance = db.execute(credit_balance(uid, amount)).scalar()
+        if balance is None:
+            db.rollback()
+            raise HTTPException(status_code=404, detail=f"User with ID {uid} not found")
 
-    transaction = models.AccountTransactions(user_id = uid, transaction_type = "Deposit", quantity=quantity)
+        db.add(models.AccountTransactions(user_id = uid, transaction_type = "Deposit", quantity=amount))
+        db.commit()
 
     try:
-        db.add(transaction)
-        db.commit()
+        run_with_retry(db, deposit)
     except SQLAlchemyError as e:
         print("Error during deposit:", str(e))
         raise HTTPException(status_code=500, detail="Error during deposit")
 
+    response_cache.invalidate(uid)
+
     return {"status": "Success"}
 
 @app.get("/users/{uid}/crypto_transactions_info", tags=["Admin"])
 def get_crypto_transactions_info(uid: str, db: Session = Depends(get_db)):
-    transactions = db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid).all()
-
-    transaction_info = []
-    for transaction in transactions:
-        transaction_data = {
-            "Cryptocurrency Name": transaction.token_name,
-            "Transaction Type": transaction.transaction_type,
-            "Average Buying Price": None,
-            "Date": datetime.fromisoformat(transaction.transaction_time.isoformat()),
-            "Quantity": transaction.quantity,
-            "Price": transaction.token_price,
-            "Amount": transaction.quantity * transaction.token_price,
-            "Realized P/L": None,
-            "Realized P/L (%)": None
-        }
-
-        # Calculate moving average buying price
-        moving_average_price_query = db.query(func.sum(models.CryptoTransactions.token_price * models.CryptoTransactions.quantity) / func.sum(models.CryptoTransactions.quantity)).filter(
-            models.CryptoTransactions.user_id == uid,
-            models.CryptoTransactions.token_name == transaction.token_name,
-            models.CryptoTransactions.transaction_type == "BUY",
-            models.CryptoTransactions.transaction_time <= transaction.transaction_time
-        ).first()
-        
-        if moving_average_price_query[0] is not None:
-            transaction_data["Average Buying Price"] = moving_average_price_query[0]
-
-        # Check if there is a corresponding sell transaction
-        sell_transaction = db.query(models.CryptoTransactions).filter(
-            models.CryptoTransactions.user_id == uid,
-            models.CryptoTransactions.token_name == transaction.token_name,
-            models.CryptoTransactions.transaction_type == "SELL",
-            models.CryptoTransactions.transaction_time == transaction.transaction_time
-        ).first()
-
-        if sell_transaction:
-            # transaction_data["Sell Date"] = sell_transaction.transaction_time.strftime("%Y-%m-%d %H:%M:%S")
-            # transaction_data["Sell Quantity"] = sell_transaction.quantity
-            # transaction_data["Sell Price"] = sell_transaction.token_price
-            # transaction_data["Sell Amount"] = sell_transaction.quantity * sell_transaction.token_price
-
-            buy_amount = moving_average_price_query[0]*sell_transaction.quantity if moving_average_price_query else 0
-            sell_amount = sell_transaction.quantity * sell_transaction.token_price
-            realized_pl = sell_amount - buy_amount
-            realized_pl_percentage = (float(realized_pl) / float(buy_amount)) * 100 if buy_amount != 0 else 0
-
-            transaction_data["Realized P/L"] = realized_pl
-            transaction_data["Realized P/L (%)"] = round(realized_pl_percentage, 6)
+    transactions = db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid).order_by(models.CryptoTransactions.transaction_time, models.CryptoTransactions.transaction_id).yield_per(1000)
 
-        transaction_info.append(transaction_data)
-
-    return transaction_info
+    return list(transactions_info(transactions))
 
 @app.post("/withdraw_money", tags=["User"])
 def withdraw_money(uid: str, quantity : str,  db: Session = Depends(get_db)):
-    
-    user_obj = db.query(models.User).filter_by(uid=uid).first()
+    amount = float(quantity)
 
-    if(user_obj.Current_Balance >= float(quantity)):
-        user_obj.Current_Balance -= float(quantity)
-    else:
-        return {"status" : "Failure", "message" : "Not enough funds to withdraw"}
+    def withdraw():
+        # Only succeeds if the balance still covers the amount when the row is updated
+        balance = db.execute(debit_balance(uid, amount)).scalar()
+        if balance is None:
+            db.rollback()
+            return False
 
-    transaction = models.AccountTransactions(user_id = uid, transaction_type = "Withdrawal", quantity=quantity)
+        db.add(models.AccountTransactions(user_id = uid, transaction_type = "Withdrawal", quantity=amount))
+        db.commit()
+        return True
 
     try:
-        db.add(transaction)
-        db.commit()
+        withdrawn = run_with_retry(db, withdraw)
     except SQLAlchemyError as e:
         print("Error during withdrawal:", str(e))
         raise HTTPException(status_code=500, detail="Error during withdrawal")
 
+    if not withdrawn:
+        return {"status" : "Failure", "message" : "Not enough funds to withdraw"}
+
+    response_cache.invalidate(uid)
+
     return {"status": "Success"}
 
 @app.get("/users/{uid}/fetch_balance", tags=["User"])
-def get_user(uid: str,  db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.uid == uid).first()
+def get_user(uid: str, request: Request,  db: Session = Depends(get_db)):
+    def balance():
+        user = db.query(models.User).filter(models.User.uid == uid).first()
 
-    if user:
-        return {"user_id": uid, "balance": user.Current_Balance}
-    else:
-        raise HTTPException(status_code=404, detail=f"User with ID {uid} not found")
+        if user:
+            return {"user_id": uid, "balance": user.Current_Balance}
+        else:
+            raise HTTPException(status_code=404, detail=f"User with ID {uid} not found")
+
+    return response_cache.respond(request, uid, "balance", balance)
     
 @app.post("/users/{uid}/buy_crypto", tags=["Crypto"])
-async def buy_crypto(uid : str, token_id : str, quantity : float,  db: Session = Depends(get_db)):
-    fetch_coin_data = f"https://coinranking1.p.rapidapi.com/coin/{token_id}"
-
-    headers = {
-        "X-RapidAPI-Key": "6c15ef80a9msh0fab964ed355602p120ff5jsn278d01eb24fb",
-        "X-RapidAPI-Host": "coinranking1.p.rapidapi.com", 
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(fetch_coin_data, headers=headers)
+async def buy_crypto(uid : str, token_id : str, quantity : float,  db: AsyncSession = Depends(get_async_db)):
+    data = await price_client.get_coin(token_id)
 
-    if response.status_code == 200:
-        data = response.json()
-        data = data["data"]["coin"]
-    else:
+    if data is None:
         return {"status": "Failed"}
     
     fiat_price = float(data["price"])*quantity
+    dialect_name = db.bind.dialect.name
 
-    user_obj = db.query(models.User).filter(models.User.uid == uid).first()
-    if user_obj.Current_Balance < fiat_price:
-        return {"status": "Failed", "Reason" : "Not enough balance in the account"}
-
-
-    user_obj.Current_Balance -= fiat_price
-    
-    user_holdings = db.query(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == uid).filter(models.CryptoHoldings.token_id == token_id).first()
-
-    if user_holdings is None:
-        holding_obj = models.CryptoHoldings(user_id = uid, token_id = token_id, token_name=data["name"], token_symbol=data["symbol"], quantity=quantity)
-    else:
-        holding_obj = user_holdings
-        holding_obj.quantity += quantity
+    async def purchase():
+        balance = (await db.execute(debit_balance(uid, fiat_price))).scalar()
+        if balance is None:
+            await db.rollback()
+            return False
 
-    transaction = models.CryptoTransactions(user_id = uid, transaction_type = "BUY", token_id=token_id, token_name=data["name"], token_symbol=data["symbol"], token_price = data["price"], quantity=quantity)
+        await db.execute(credit_holding(dialect_name, uid, token_id, data["name"], data["symbol"], quantity))
+        db.add(models.CryptoTransactions(user_id = uid, transaction_type = "BUY", token_id=token_id, token_name=data["name"], token_symbol=data["symbol"], token_price = data["price"], quantity=quantity))
+        await db.execute(trade_statement(dialect_name, uid, token_id, data["name"], data["symbol"], "BUY", float(data["price"]), quantity))
+        await db.commit()
+        return True
 
     try:
-        db.add(holding_obj)
-        db.add(transaction)
-        db.commit()
+        purchased = await run_with_retry_async(db, purchase)
     except SQLAlchemyError as e:
         print("Error during purchasing:", str(e))
         raise HTTPException(status_code=404, detail="Error during purchasing")
+
+    if not purchased:
+        return {"status": "Failed", "Reason" : "Not enough balance in the account"}
+
+    # Off the event loop, as the Redis backend blocks on a round-trip
+    await run_in_threadpool(response_cache.invalidate, uid)
     
     return {"status" : "Success"}
 
 @app.post("/users/{uid}/sell_crypto", tags=["Crypto"])
-async def sell_crypto(uid : str, token_id : str, quantity : float,  db: Session = Depends(get_db)):
-    fetch_coin_data = f"https://coinranking1.p.rapidapi.com/coin/{token_id}"
+async def sell_crypto(uid : str, token_id : str, quantity : float,  db: AsyncSession = Depends(get_async_db)):
+    data = await price_client.get_coin(token_id)
 
-    headers = {
-        "X-RapidAPI-Key": "6c15ef80a9msh0fab964ed355602p120ff5jsn278d01eb24fb",
-        "X-RapidAPI-Host": "coinranking1.p.rapidapi.com", 
-    }
+    if data is None:
+        return {"status": "Failed"}
 
-    user_holding = db.query(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == uid).filter(models.CryptoHoldings.token_id == token_id).first()
-    
-    holding_quantity = user_holding.quantity
+    fiat_cash = float(data["price"])*quantity
+    dialect_name = db.bind.dialect.name
 
-    if holding_quantity >= quantity:
-        user_holding.quantity -= quantity
+    async def sale():
+        # Users row first, then holdings, same lock order as buy_crypto
+        balance = (await db.execute(credit_balance(uid, fiat_cash))).scalar()
+        remaining = (await db.execute(debit_holding(uid, token_id, quantity))).scalar()
+        if balance is None or remaining is None:
+            await db.rollback()
+            return False
 
-        async with httpx.AsyncClient() as client:
-            response = await client.get(fetch_coin_data, headers=headers)
+        db.add(models.CryptoTransactions(user_id = uid, transaction_type = "SELL", token_id=token_id, token_name=data["name"], token_symbol=data["symbol"], token_price = data["price"], quantity=quantity))
+        await db.execute(trade_statement(dialect_name, uid, token_id, data["name"], data["symbol"], "SELL", float(data["price"]), quantity))
+        await db.commit()
+        return True
 
-        if response.status_code == 200:
-            data = response.json()
-            data = data["data"]["coin"]
-        else:
-            return {"status": "Failed"}
-        
-        transaction = models.CryptoTransactions(user_id = uid, transaction_type = "SELL", token_id=token_id, token_name=data["name"], token_symbol=data["symbol"], token_price = data["price"], quantity=quantity)
-        user_obj = db.query(models.User).filter(models.User.uid == uid).first()
+    try:
+        sold = await run_with_retry_async(db, sale)
+    except SQLAlchemyError as e:
+        print("Error during purchasing:", str(e))
+        raise HTTPException(status_code=404, detail="Error during purchasing")
 
-        fiat_cash = float(data["price"])*quantity
+    if not sold:
+        return {"status": "Failed", "Reason" : "Not enough holdings"}
 
-        user_obj.Current_Balance += fiat_cash
-        try:
-            db.add(transaction)
-            db.commit()
-        except SQLAlchemyError as e:
-            print("Error during purchasing:", str(e))
-            raise HTTPException(status_code=404, detail="Error during purchasing")
+    await run_in_threadpool(response_cache.invalidate, uid)
         
-        return {"status" : "Success"}
-    else:
-        return {"status": "Failed", "Reason" : "Not enough holdings"}
+    return {"status" : "Success"}
     
+@app.post("/users/{uid}/orders", tags=["Crypto"])
+async def submit_orders(uid : str, orders : List[Order],  db: AsyncSession = Depends(get_async_db)):
+    if len(orders) > MAX_BATCH_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ORDERS} orders per batch")
+
+    quotes = await price_client.get_quotes([order.token_id for order in orders])
+
+    try:
+        results = await run_with_retry_async(db, lambda: execute_orders(db, uid, orders, quotes))
+    except LedgerConflict:
+        raise HTTPException(status_code=409, detail="Account changed during the batch, please retry")
+    except SQLAlchemyError as e:
+        print("Error during batch order:", str(e))
+        raise HTTPException(status_code=500, detail="Error during batch order")
+
+    if results is None:
+        raise HTTPException(status_code=404, detail=f"User with ID {uid} not found")
+
+    succeeded = sum(result["status"] == "Success" for result in results)
+    if succeeded:
+        await run_in_threadpool(response_cache.invalidate, uid)
+
+    return {"status": "Success" if succeeded else "Failed", "orders": results}
+
 @app.get("/fetch_coin_data")
-async def fetch_coin_data(db: Session = Depends(get_db)):
-    fetch_coin_data = "https://coinranking1.p.rapidapi.com/coins"
-
-    headers = {
-        "X-RapidAPI-Key": "6c15ef80a9msh0fab964ed355602p120ff5jsn278d01eb24fb",
-        "X-RapidAPI-Host": "coinranking1.p.rapidapi.com", 
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(fetch_coin_data, headers=headers)
-
-    if response.status_code == 200:
-        data = response.json()
-        coins = data["data"]["coins"]
-
-        for coin in coins:
-            coin_data = models.Crypto_Prices(
-                token_id=coin["uuid"],
-                token_name=coin["name"],
-                token_symbol=coin["symbol"],
-                token_price=float(coin["price"]),
-            )
-
-            db.add(coin_data)
-        db.commit()
+async def fetch_coin_data(db: AsyncSession = Depends(get_async_db)):
+    coins = await price_client.get_coins()
+
+    if coins is not None:
+        await store_snapshot(db, coins)
 
     return {"status": "Success"}
 
+@app.websocket("/ws/prices")
+async def stream_prices_ws(websocket: WebSocket, uid: Optional[str] = None):
+    # Pushes {"type": "prices"} and, with a uid, {"type": "portfolio"} messages as they change
+    await websocket.accept()
+    subscriber = price_stream.subscribe(uid)
+
+    async def wait_for_disconnect():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    disconnected = asyncio.create_task(wait_for_disconnect())
+    try:
+        while not disconnected.done():
+            received = asyncio.create_task(subscriber.queue.get())
+            await asyncio.wait({received, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not received.done():
+                received.cancel()
+                break
+            await websocket.send_json(received.result())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        price_stream.unsubscribe(subscriber)
+        disconnected.cancel()
+
+@app.get("/stream/prices", tags=["Crypto"])
+async def stream_prices_sse(request: Request, uid: Optional[str] = None):
+    # Same messages as /ws/prices as Server-Sent Events
+    subscriber = price_stream.subscribe(uid)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), 15)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            price_stream.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get('/stream/stats', tags=["Admin"])
+def stream_stats():
+    return price_stream.stats()
+
+@app.get("/latest_prices", tags=["Crypto"])
+def latest_prices(db: Session = Depends(get_db)):
+    prices = db.execute(latest_prices_query()).scalars().all()
+
+    return prices
+
 @app.get("/users/{uid}/crypto_holdings", tags=["Crypto"])
-def get_crypto_holdings(uid:str,  db: Session = Depends(get_db)):
-    holdings = db.query(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == uid).filter(models.CryptoHoldings.quantity != 0).order_by(models.CryptoHoldings.bought_at.desc()).all()
+def get_crypto_holdings(uid:str, request: Request,  db: Session = Depends(get_db)):
+    def holdings():
+        return db.query(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == uid).filter(models.CryptoHoldings.quantity != 0).order_by(models.CryptoHoldings.bought_at.desc()).all()
 
-    return holdings
+    return response_cache.respond(request, uid, "holdings", holdings)
 
 @app.get("/users/{uid}/crypto_transactions", tags=["Crypto"])
-def crypto_transactions(uid:str,  db: Session = Depends(get_db)):
-    holdings = db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid).order_by(models.CryptoTransactions.transaction_time.desc()).all()
+def crypto_transactions(uid:str, response: Response, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), format: str = Query("json", regex="^(json|ndjson)$"),  db: Session = Depends(get_db)):
+    columns = (models.CryptoTransactions.transaction_id,)
+    holdings = keyset(db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid), columns, cursor)
+
+    if format == "ndjson":
+        return ndjson_response(holdings)
 
-    return holdings
+    return page(holdings, columns, limit, response)
 
 @app.get("/users/{uid}/fiat_transactions", tags=["Crypto"])
-def fiat_transactions(uid:str,  db: Session = Depends(get_db)):
-    holdings = db.query(models.AccountTransactions).filter(models.AccountTransactions.user_id == uid).order_by(models.AccountTransactions.transaction_time.desc()).all()
+def fiat_transactions(uid:str, response: Response, cursor: Optional[str] = None, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), format: str = Query("json", regex="^(json|ndjson)$"),  db: Session = Depends(get_db)):
+    columns = (models.AccountTransactions.transaction_id,)
+    holdings = keyset(db.query(models.AccountTransactions).filter(models.AccountTransactions.user_id == uid), columns, cursor)
 
-    return holdings
+    if format == "ndjson":
+        return ndjson_response(holdings)
+
+    return page(holdings, columns, limit, response)
 
 @app.get("/users/{uid}/get_crypto_holding", tags=["Crypto"])
-def get_crypto_holding(uid:str, token_id:str,  db: Session = Depends(get_db)):
-    holdings = db.query(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == uid).filter(models.CryptoHoldings.token_id == token_id).filter(models.CryptoHoldings.quantity != 0).order_by(models.CryptoHoldings.bought_at.desc()).first()
+def get_crypto_holding(uid:str, token_id:str, request: Request,  db: Session = Depends(get_db)):
+    def holding():
+        holdings = db.query(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == uid).filter(models.CryptoHoldings.token_id == token_id).filter(models.CryptoHoldings.quantity != 0).order_by(models.CryptoHoldings.bought_at.desc()).first()
 
-    if holdings is None:
-        return {"status" : "Token not available", "quantity" : 0}
-    
-    return holdings
+        if holdings is None:
+            return {"status" : "Token not available", "quantity" : 0}
+
+        return holdings
+
+    return response_cache.respond(request, uid, f"holding:{token_id}", holding)
 
 @app.get("/users/{uid}/initial_portfolio_value", tags=["Crypto"])
 def initial_portfolio_value(uid:str,  db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.uid == uid).first()
-    transactions = user.transactions_crypto
+    original_value = db.query(func.coalesce(func.sum(models.PortfolioAggregates.net_cost), 0.0)).filter(models.PortfolioAggregates.user_id == uid).scalar()
 
-    original_value = 0.0
+    return { "original_value" : original_value }
 
-    for transaction in transactions:
-        if transaction.transaction_type == "SELL":
-            original_value -= transaction.token_price * transaction.quantity
-        else:
-            original_value += transaction.token_price * transaction.quantity
+@app.get("/users/{uid}/portfolio", tags=["Crypto"])
+def get_portfolio(uid:str,  db: Session = Depends(get_db)):
+    aggregates = db.query(models.PortfolioAggregates).filter(models.PortfolioAggregates.user_id == uid).filter(models.PortfolioAggregates.quantity > 0).all()
 
-    return { "original_value" : original_value }
+    return aggregates
 
 @app.get('/get_volatility', tags=["Crypto"])
 def get_volatility(db: Session = Depends(get_db)):
-    # Get the top 10 cryptocurrencies from Yahoo Finance
-    tickers = ["BTC-USD", "ETH-USD", "USDT-USD", "BNB-USD", "XRP-USD", "ADA-USD", "DOGE-USD", "MATIC-USD", "DOT-USD", "LTC-USD"]
-    data = yf.download(tickers, period="90d", auto_adjust=True, threads=True)
-
-    # Create a DataFrame with the cryptocurrency data
-    df = pd.DataFrame()
-    for ticker in tickers:
-        df[ticker] = data['Close'][ticker]
+    # Kept up to date by the background refresh, see refresh_volatility_periodically
+    volatility = db.query(models.VolatilityIndex).order_by(models.VolatilityIndex.date.desc()).limit(WINDOW_DAYS).all()
 
-    # Calculate daily percentage changes
-    daily_changes = df.pct_change().dropna()
+    return volatility
 
-    # Calculate average daily percentage change
-    avg_daily_pct_change = daily_changes.mean(axis=1)
+@app.post('/refresh_volatility', tags=["Admin"])
+async def refresh_volatility_now(response: Response):
+    try:
+        job_id = await analytics_pool.submit_async(VOLATILITY, volatility_job)
+        added = await analytics_pool.wait(job_id)
+    except Exception as e:
+        print("Error refreshing volatility index:", str(e))
+        raise HTTPException(status_code=500, detail="Error refreshing volatility index")
 
-    # Calculate volatility index (standard deviation of daily returns)
-    volatility_index = daily_changes.std(axis=1)
+    if added is None:
+        response.status_code = 202
+        return {"status": "Pending", "job_id": job_id}
 
-    # Normalize volatility index between 0 and 1
-    scaler = MinMaxScaler()
-    normalized_volatility_index = scaler.fit_transform(volatility_index.values.reshape(-1, 1))
+    return {"status": "Success", "days_added": added}
 
-    # Resample to monthly frequency
-    monthly_data = pd.DataFrame({
-        'normalized_volatility_index': pd.Series(normalized_volatility_index.ravel(), index=avg_daily_pct_change.index).resample('D').mean()
-    })
+async def stress_metrics_or_job(db, uids, response):
+    # Stored or freshly computed metrics, or a job id to poll at /jobs/{job_id}.
+    # Awaits the job instead of blocking a threadpool thread on it
+    volatility_date = await run_in_threadpool(latest_volatility_date, db)
+    if volatility_date is None:
+        raise HTTPException(status_code=503, detail="Volatility index not available yet")
 
-    # Store the monthly data in the VolatilityIndex table
-    # for index, row in monthly_data.iterrows():
-    #     volatility_record = models.VolatilityIndex(
-    #         normalized_volatility_index=row['normalized_volatility_index'],
-    #         date=index
-    #     )
-    #     db.add(volatility_record)
-    # db.commit()
+    try:
+        stress_metrics, job_id = await analytics_pool.stress_metrics(db, uids, volatility_date)
+    except Exception as e:
+        print("Error calculating stress metric:", str(e))
+        raise HTTPException(status_code=500, detail="Error calculating stress metric")
 
-    return monthly_data
+    if stress_metrics is None:
+        response.status_code = 202
+    return stress_metrics, job_id
 
 @app.get('/users/{uid}/calculate_stress_metric', tags=["Crypto"])
-def calculate_stress_metric(uid: str, db: Session = Depends(get_db)):
-    # Load the stress model
-    with open('stress_model.pkl', 'rb') as f:
-        clf2 = pickle.load(f)
-
-    # Get the latest normalized volatility index from the database
-    latest_volatility = db.query(models.VolatilityIndex).order_by(models.VolatilityIndex.date.desc()).first()
-    market_volatility = latest_volatility.normalized_volatility_index
-
-    # Get the crypto transactions info
-    transactions_info = get_crypto_transactions_info(uid, db)
-
-    # Group the transactions by day and count the number of trades per day
-    today = datetime.now().date()
-    num_trades_per_day = {}
-    for i in range(90):
-        day = today - timedelta(days=i)
-        transactions_on_day = [t for t in transactions_info if t['Date'].date() == day]
-        num_trades_per_day[day] = len(transactions_on_day)
-
-    # Calculate the required variables
-    realized_pl_ratios = [t['Realized P/L (%)'] for t in transactions_info if t['Realized P/L (%)'] is not None]
-    if realized_pl_ratios:
-        realized_pl_ratio = sum(realized_pl_ratios) / len(realized_pl_ratios)
-    else:
-        realized_pl_ratio = 0
-    num_trades = sum(num_trades_per_day.values())
-
-    # Use the model to calculate the stress metric
-    stress_metric = clf2.predict([[num_trades, market_volatility, realized_pl_ratio]])[0]
-
-    return {'stress_metric': stress_metric}
+async def calculate_stress_metric(uid: str, response: Response, db: Session = Depends(get_db)):
+    stress_metrics, job_id = await stress_metrics_or_job(db, [uid], response)
+    if stress_metrics is None:
+        return {"status": "Pending", "job_id": job_id}
+
+    return {'stress_metric': stress_metrics[uid]}
+
+@app.post('/calculate_stress_metrics', tags=["Admin"])
+async def calculate_stress_metrics(response: Response, uids: List[str] = Body(...), db: Session = Depends(get_db)):
+    uids = list(dict.fromkeys(uids))
+    if not uids:
+        return {}
+
+    # One job, and one predict call, for every uid without a stored metric
+    stress_metrics, job_id = await stress_metrics_or_job(db, uids, response)
+    if stress_metrics is None:
+        return {"status": "Pending", "job_id": job_id}
+
+    return stress_metrics
+
+@app.get('/jobs/{job_id}', tags=["Admin"])
+def get_job(job_id: str):
+    # Jobs are tracked by the worker that accepted them
+    job = analytics_pool.job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    return job
+
+@app.get('/analytics/stats', tags=["Admin"])
+def analytics_stats():
+    return analytics_pool.stats()
+
+@app.get("/export/{table}", tags=["Admin"])
+def export_transactions(table: str, format: str = Query("parquet", regex="^(arrow|parquet)$"), uids: Optional[List[str]] = Query(None), start: Optional[datetime] = None, end: Optional[datetime] = None, db: Session = Depends(get_db)):
+    # Transactions as a streamed Parquet file or Arrow IPC stream, see export.py
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table {table}, expected one of {', '.join(EXPORT_TABLES)}")
+
+    return export_response(db, table, format, uids, start, end)
+
+@app.get('/cache/stats', tags=["Admin"])
+def cache_stats():
+    return response_cache.stats()
+
+@app.get('/stress_model/metrics', tags=["Admin"])
+def stress_model_metrics():
+    return analytics_pool.model_metrics()
 
 @app.post("/users/{uid}/submitfeeling")
 def submit_feeling(uid: str, feeling: str, db: Session = Depends(get_db)):
@@ -0,0 +1,286 @@
+# Request timing, per-request database/upstream accounting and a Prometheus
+# text endpoint, plus opt-in profiling of slow requests.
+import asyncio
+import contextvars
+import cProfile
+import functools
+import os
+import re
+import threading
+import time
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool as fastapi_run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.routing import Match
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+# Requests slower than this get their profile written to PROFILE_DIR; 0 disables profiling
+PROFILE_SLOW_REQUESTS_MS = float(os.getenv("PROFILE_SLOW_REQUESTS_MS", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Interval of the event loop lag probe
+LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+def format_labels(labelnames, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+def sample(name, documentation, kind, value):
+    # A single unlabelled gauge or counter, for values kept elsewhere
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+# handler is how the route is declared (async def or def); where the time
+# went is in http_request_threadpool_seconds and http_request_loop_seconds
+REQUEST_LABELS = ("method", "route", "handler")
+
+request_duration = Histogram("http_request_duration_seconds", "Request latency by route; handler is async for async def endpoints and sync for def ones", REQUEST_LABELS)
+responses = Counter("http_responses_total", "Responses by route and status code", ("method", "route", "status"))
+request_db_queries = Histogram("http_request_db_queries", "Database statements executed per request", REQUEST_LABELS, COUNT_BUCKETS)
+request_db_seconds = Histogram("http_request_db_seconds", "Time spent in database statements per request", REQUEST_LABELS)
+request_upstream_seconds = Histogram("http_request_upstream_seconds", "Time spent waiting on coinranking per request", REQUEST_LABELS)
+request_threadpool_seconds = Histogram("http_request_threadpool_seconds", "Time spent running in threadpool threads per request: def endpoints and run_in_threadpool calls", REQUEST_LABELS)
+request_loop_seconds = Histogram("http_request_loop_seconds", "Request latency minus its threadpool time: on the event loop or awaiting I/O", REQUEST_LABELS)
+db_query_seconds = Histogram("db_query_seconds", "Latency of every database statement, background jobs included")
+upstream_seconds = Histogram("upstream_request_seconds", "Latency of coinranking requests", ("endpoint",))
+event_loop_lag = Histogram("event_loop_lag_seconds", "How late the event loop ran a timer, i.e. time it spent blocked")
+
+REGISTRY = [request_duration, responses, request_db_queries, request_db_seconds, request_upstream_seconds, request_threadpool_seconds, request_loop_seconds, db_query_seconds, upstream_seconds, event_loop_lag]
+
+# Per-request accumulators; a mutable dict so work in the threadpool
+# (which runs in a copy of the context) adds to the same totals
+request_stats = contextvars.ContextVar("request_stats", default=None)
+
+def instrument_engine(sync_engine):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started_at"].pop()
+        db_query_seconds.observe(elapsed)
+
+        stats = request_stats.get()
+        if stats is not None:
+            stats["db_queries"] += 1
+            stats["db_seconds"] += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def drop_timer(context):
+        # after_cursor_execute doesn't run for failed statements; as in
+        # Database/sql.py, an empty list means the cursor never ran
+        started = context.connection.info.get("metrics_started_at") if context.connection is not None else None
+        if started:
+            started.pop()
+
+def observe_upstream(endpoint, seconds):
+    upstream_seconds.observe(seconds, endpoint)
+
+    stats = request_stats.get()
+    if stats is not None:
+        stats["upstream_seconds"] += seconds
+
+def timed(fn):
+    # Adds fn's running time to the request's threadpool_seconds. Wraps what
+    # is handed to the threadpool, so only time in a worker thread counts,
+    # not time waiting for one
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stats = request_stats.get()
+            if stats is not None:
+                stats["threadpool_seconds"] += time.perf_counter() - started
+    return wrapper
+
+async def run_in_threadpool(fn, *args, **kwargs):
+    return await fastapi_run_in_threadpool(timed(fn), *args, **kwargs)
+
+class TimedRoute(APIRoute):
+    # FastAPI runs def endpoints in the threadpool; timing them here covers
+    # every sync route
+    def __init__(self, path, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = timed(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+def match_route(app, scope):
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            endpoint = getattr(route, "endpoint", None)
+            handler = "async" if asyncio.iscoroutinefunction(endpoint) else "sync"
+            return route.path, handler
+    return "unmatched", "none"
+
+# Only one profiler may be active per process (3.12+ refuses a second
+# cProfile and earlier versions mix up their results), so requests that
+# start while another is being profiled go unprofiled
+profiling = threading.Lock()
+
+def start_profiler():
+    if not profiling.acquire(blocking=False):
+        return None
+
+    try:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            # cProfile only sees the calling thread, so sync endpoints are
+            # profiled best with pyinstrument
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        return profiler
+    except Exception:
+        profiling.release()
+        raise
+
+def save_profile(profiler, method, route, elapsed, keep):
+    try:
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+    finally:
+        profiling.release()
+    if not keep:
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{method}{route}").strip("_")
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{elapsed * 1000:.0f}ms")
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.dump_stats(path + ".prof")
+    else:
+        with open(path + ".html", "w") as f:
+            f.write(profiler.output_html())
+
+def install(app):
+    # Before any route is added, so all of them are TimedRoutes
+    app.router.route_class = TimedRoute
+
+    @app.middleware("http")
+    async def record_request(request: Request, call_next):
+        route, handler = match_route(app, request.scope)
+        labels = (request.method, route, handler)
+
+        stats = {"db_queries": 0, "db_seconds": 0.0, "upstream_seconds": 0.0, "threadpool_seconds": 0.0}
+        token = request_stats.set(stats)
+        profiler = start_profiler() if PROFILE_SLOW_REQUESTS_MS > 0 else None
+
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            request_stats.reset(token)
+
+            request_duration.observe(elapsed, *labels)
+            responses.inc(1, request.method, route, str(status))
+            request_db_queries.observe(stats["db_queries"], *labels)
+            request_db_seconds.observe(stats["db_seconds"], *labels)
+            request_upstream_seconds.observe(stats["upstream_seconds"], *labels)
+            request_threadpool_seconds.observe(stats["threadpool_seconds"], *labels)
+            request_loop_seconds.observe(max(0.0, elapsed - stats["threadpool_seconds"]), *labels)
+
+            if profiler is not None:
+                save_profile(profiler, request.method, route, elapsed, elapsed * 1000 >= PROFILE_SLOW_REQUESTS_MS)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        lines = []
+        for metric in REGISTRY + list(app.state.extra_metrics):
+            lines.extend(metric() if callable(metric) else metric.render())
+        return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+    @app.on_event("startup")
+    async def start_loop_lag_probe():
+        app.state.loop_lag_probe = asyncio.create_task(probe_loop_lag())
+
+    @app.on_event("shutdown")
+    async def stop_loop_lag_probe():
+        app.state.loop_lag_probe.cancel()
+
+    app.state.extra_metrics = []
+
+async def probe_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL_SECONDS
+        await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+        event_loop_lag.observe(max(0.0, loop.time() - expected))
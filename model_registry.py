@@ -0,0 +1,96 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+STRESS_MODEL_PATH = os.getenv("STRESS_MODEL_PATH", "stress_model.pkl")
+
+# How often to stat the model file for changes
+MODEL_CHECK_SECONDS = float(os.getenv("MODEL_CHECK_SECONDS", "5"))
+
+
+# Holds one unpickled model per process. Load it at startup (before forking
+# workers with --preload the pages are shared copy-on-write) and swap in a
+# new one when the file on disk changes.
+class ModelRegistry:
+
+    def __init__(self, path, check_interval=MODEL_CHECK_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._model = None
+        self._stat = None
+        self._digest = None
+        self._checked_at = 0.0
+
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.predictions = 0
+        self.predict_seconds = 0.0
+
+    def load(self):
+        with self._lock:
+            self._load()
+        return self._model
+
+    def get(self):
+        if self._model is None or time.monotonic() - self._checked_at >= self.check_interval:
+            with self._lock:
+                try:
+                    if self._model is None or self._file_stat() != self._stat:
+                        self._load()
+                except FileNotFoundError:
+                    # Keep serving the loaded model while the file is being replaced
+                    if self._model is None:
+                        raise
+                self._checked_at = time.monotonic()
+        return self._model
+
+    def predict(self, rows):
+        model = self.get()
+
+        started = time.perf_counter()
+        result = model.predict(rows)
+        self.predict_seconds += time.perf_counter() - started
+        self.predictions += 1
+
+        return result
+
+    def metrics(self):
+        return {
+            "path": self.path,
+            "loaded": self._model is not None,
+            "digest": self._digest,
+            "loads": self.loads,
+            "load_seconds": self.load_seconds,
+            "predictions": self.predictions,
+            "predict_seconds": self.predict_seconds,
+            "predict_seconds_avg": self.predict_seconds / self.predictions if self.predictions else None,
+        }
+
+    def _file_stat(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self):
+        started = time.perf_counter()
+
+        stat = self._file_stat()
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+
+        # A touched but unchanged file keeps the current model
+        if digest != self._digest:
+            model = pickle.loads(data)
+            self._model = model
+            self._digest = digest
+            self.loads += 1
+            self.load_seconds = time.perf_counter() - started
+
+        self._stat = stat
+
+
+stress_model = ModelRegistry(STRESS_MODEL_PATH)
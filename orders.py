@@ -0,0 +1,104 @@
+from sqlalchemy import insert, select
+
+from Database import models
+from ledger import LedgerConflict, credit_balance, credit_holdings, debit_balance, debit_holding
+from portfolio import trade_statement
+
+MAX_BATCH_ORDERS = 100
+
+def plan_orders(orders, quotes, balance, holdings):
+    # Accepts orders in the order given while the running balance and
+    # holdings still cover them; returns the per-order results and the
+    # accepted (order, coin) pairs
+    holdings = dict(holdings)
+    results = []
+    accepted = []
+
+    for order in orders:
+        result = {"token_id": order.token_id, "side": order.side, "quantity": order.quantity}
+        coin = quotes.get(order.token_id)
+
+        if coin is None:
+            result.update(status="Failed", Reason="Price not available")
+        else:
+            amount = float(coin["price"]) * order.quantity
+            held = holdings.get(order.token_id, 0.0)
+
+            if order.side == "BUY" and balance < amount:
+                result.update(status="Failed", Reason="Not enough balance in the account")
+            elif order.side == "SELL" and held < order.quantity:
+                result.update(status="Failed", Reason="Not enough holdings")
+            else:
+                if order.side == "BUY":
+                    balance -= amount
+                    holdings[order.token_id] = held + order.quantity
+                else:
+                    balance += amount
+                    holdings[order.token_id] = held - order.quantity
+                result.update(status="Success", price=float(coin["price"]))
+                accepted.append((order, coin))
+
+        results.append(result)
+
+    return results, accepted
+
+async def execute_orders(db, uid, orders, quotes):
+    # Validates the whole batch against one read of the account and applies
+    # the accepted orders in a single transaction. Returns None for an
+    # unknown user.
+    dialect_name = db.bind.dialect.name
+
+    balance = (await db.execute(select(models.User.Current_Balance).filter(models.User.uid == uid))).scalar()
+    if balance is None:
+        return None
+
+    token_ids = {order.token_id for order in orders}
+    holdings = dict((await db.execute(
+        select(models.CryptoHoldings.token_id, models.CryptoHoldings.quantity)
+        .filter(models.CryptoHoldings.user_id == uid)
+        .filter(models.CryptoHoldings.token_id.in_(token_ids))
+    )).all())
+
+    results, accepted = plan_orders(orders, quotes, balance, {token_id: quantity or 0.0 for token_id, quantity in holdings.items()})
+    if not accepted:
+        return results
+
+    cash = 0.0
+    net_quantity = {}
+    for order, coin in accepted:
+        amount = float(coin["price"]) * order.quantity
+        sign = 1 if order.side == "BUY" else -1
+        cash -= sign * amount
+        net_quantity[order.token_id] = net_quantity.get(order.token_id, 0.0) + sign * order.quantity
+
+    # Users row first, then holdings, same lock order as the single trades
+    if cash >= 0:
+        updated = (await db.execute(credit_balance(uid, cash))).scalar()
+    else:
+        updated = (await db.execute(debit_balance(uid, -cash))).scalar()
+    if updated is None:
+        raise LedgerConflict()
+
+    coins = {order.token_id: coin for order, coin in accepted}
+    credits = [
+        {"user_id": uid, "token_id": token_id, "token_name": coins[token_id]["name"], "token_symbol": coins[token_id]["symbol"], "quantity": quantity}
+        for token_id, quantity in net_quantity.items() if quantity > 0
+    ]
+    if credits:
+        await db.execute(credit_holdings(dialect_name), credits)
+
+    for token_id, quantity in net_quantity.items():
+        if quantity < 0 and (await db.execute(debit_holding(uid, token_id, -quantity))).scalar() is None:
+            raise LedgerConflict()
+
+    await db.execute(insert(models.CryptoTransactions), [
+        {"user_id": uid, "transaction_type": order.side, "token_id": order.token_id, "token_name": coin["name"], "token_symbol": coin["symbol"], "token_price": float(coin["price"]), "quantity": order.quantity}
+        for order, coin in accepted
+    ])
+
+    for order, coin in accepted:
+        await db.execute(trade_statement(dialect_name, uid, order.token_id, coin["name"], coin["symbol"], order.side, float(coin["price"]), order.quantity))
+
+    await db.commit()
+
+    return results
@@ -0,0 +1,65 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Rows fetched per round trip from the server-side cursor when streaming
+STREAM_BATCH_SIZE = 1000
+
+def encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(columns):
+            raise ValueError("cursor does not match the sort columns")
+        return [
+            datetime.fromisoformat(value) if column.type.python_type is datetime else column.type.python_type(value)
+            for value, column in zip(values, columns)
+        ]
+    except (binascii.Error, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset(query, columns, cursor=None, descending=True):
+    # Orders by columns (which must be unique together) and resumes after the
+    # row the cursor points at, so every page is an index range scan.
+    # Transaction histories page on transaction_id alone: it grows with every
+    # insert, while a transaction_time cursor doesn't compare reliably on
+    # SQLite, where server_default times have no microseconds
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        if descending:
+            query = query.filter(tuple_(*columns) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+
+    return query.order_by(*[column.desc() if descending else column for column in columns])
+
+def page(query, columns, limit, response):
+    # One page of rows; the cursor for the next one goes in X-Next-Cursor
+    rows = query.limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+
+    return rows
+
+def ndjson_response(query):
+    # Streams every row as one JSON line straight from a server-side cursor.
+    # The session from get_db stays open until the response has been sent.
+    def lines():
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            yield json.dumps(jsonable_encoder(row)) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,138 @@
+import argparse
+from itertools import groupby
+
+from sqlalchemy import delete, func, insert, select
+
+from Database import models
+from Database.upsert import dialect_insert
+
+AGGREGATE_COLUMNS = ["quantity", "net_cost", "buy_cost", "buy_quantity", "realized_pl"]
+
+def trade_aggregates(transaction_type, token_price, quantity):
+    # What a single trade adds to a fresh aggregate row
+    amount = token_price * quantity
+    if transaction_type == "SELL":
+        return {"quantity": -quantity, "net_cost": -amount, "buy_cost": 0.0, "buy_quantity": 0.0, "realized_pl": amount}
+    return {"quantity": quantity, "net_cost": amount, "buy_cost": amount, "buy_quantity": quantity, "realized_pl": 0.0}
+
+def trade_statement(dialect_name, uid, token_id, token_name, token_symbol, transaction_type, token_price, quantity):
+    # Upsert that applies one trade to the user's aggregate row with SQL-side
+    # arithmetic, so it can run in the trade's own transaction
+    table = models.PortfolioAggregates.__table__
+    values = trade_aggregates(transaction_type, token_price, quantity)
+
+    stmt = dialect_insert(dialect_name, table).values(user_id=uid, token_id=token_id, token_name=token_name, token_symbol=token_symbol, **values)
+
+    set_ = {column: table.c[column] + stmt.excluded[column] for column in AGGREGATE_COLUMNS}
+    set_["time_updated"] = func.now()
+
+    if transaction_type == "SELL":
+        # Realized P/L against the average buying price before this sell
+        average_price = func.coalesce(table.c.buy_cost / func.nullif(table.c.buy_quantity, 0), 0)
+        set_["realized_pl"] = table.c.realized_pl + stmt.excluded.realized_pl - quantity * average_price
+
+    return stmt.on_conflict_do_update(index_elements=["user_id", "token_id"], set_=set_)
+
+def compute_aggregates(transactions):
+    # Replays time-ordered trades the same way trade_statement applies them
+    aggregates = {}
+
+    for transaction in transactions:
+        key = (transaction.user_id, transaction.token_id)
+        row = aggregates.get(key)
+        if row is None:
+            row = aggregates[key] = {"user_id": transaction.user_id, "token_id": transaction.token_id, "token_name": transaction.token_name, "token_symbol": transaction.token_symbol, **dict.fromkeys(AGGREGATE_COLUMNS, 0.0)}
+
+        delta = trade_aggregates(transaction.transaction_type, transaction.token_price, transaction.quantity)
+        if transaction.transaction_type == "SELL" and row["buy_quantity"]:
+            delta["realized_pl"] -= transaction.quantity * row["buy_cost"] / row["buy_quantity"]
+
+        for column in AGGREGATE_COLUMNS:
+            row[column] += delta[column]
+
+    return aggregates.values()
+
+def transactions_query(uids=None):
+    query = select(
+        models.CryptoTransactions.user_id,
+        models.CryptoTransactions.token_id,
+        models.CryptoTransactions.token_name,
+        models.CryptoTransactions.token_symbol,
+        models.CryptoTransactions.transaction_type,
+        models.CryptoTransactions.token_price,
+        models.CryptoTransactions.quantity,
+    ).order_by(
+        models.CryptoTransactions.user_id,
+        models.CryptoTransactions.transaction_time,
+        models.CryptoTransactions.transaction_id,
+    )
+    if uids:
+        query = query.filter(models.CryptoTransactions.user_id.in_(uids))
+    return query
+
+def user_aggregates(db, uids=None):
+    # Yields (uid, aggregate rows), one user at a time
+    rows = db.execute(transactions_query(uids).execution_options(yield_per=5000))
+    for uid, transactions in groupby(rows, key=lambda row: row.user_id):
+        yield uid, list(compute_aggregates(transactions))
+
+def rebuild_aggregates(db, uids=None, batch_size=5000):
+    query = delete(models.PortfolioAggregates)
+    if uids:
+        query = query.filter(models.PortfolioAggregates.user_id.in_(uids))
+    db.execute(query)
+
+    batch = []
+    total = 0
+    for _, aggregates in user_aggregates(db, uids):
+        batch.extend(aggregates)
+        if len(batch) >= batch_size:
+            db.execute(insert(models.PortfolioAggregates), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(models.PortfolioAggregates), batch)
+        total += len(batch)
+
+    db.commit()
+    return total
+
+def verify_aggregates(db, uids=None, tolerance=1e-6):
+    # Compares stored aggregates with a fresh replay; returns the mismatches
+    mismatches = []
+
+    for uid, aggregates in user_aggregates(db, uids):
+        stored = {row.token_id: row for row in db.query(models.PortfolioAggregates).filter(models.PortfolioAggregates.user_id == uid)}
+        for expected in aggregates:
+            row = stored.pop(expected["token_id"], None)
+            if row is None:
+                mismatches.append((uid, expected["token_id"], "missing", None, None))
+                continue
+            for column in AGGREGATE_COLUMNS:
+                if abs(getattr(row, column) - expected[column]) > tolerance * max(1.0, abs(expected[column])):
+                    mismatches.append((uid, expected["token_id"], column, getattr(row, column), expected[column]))
+        for token_id in stored:
+            mismatches.append((uid, token_id, "unexpected", None, None))
+
+    return mismatches
+
+def main():
+    from Database.sql import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild or verify portfolio_aggregates from transactions_crypto")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    parser.add_argument("--uid", action="append", help="limit to these users (repeatable)")
+    args = parser.parse_args()
+
+    with SessionLocal() as db:
+        if args.command == "rebuild":
+            print("Rebuilt", rebuild_aggregates(db, args.uid), "aggregate rows")
+        else:
+            mismatches = verify_aggregates(db, args.uid)
+            for mismatch in mismatches:
+                print("Mismatch:", *mismatch)
+            print(len(mismatches), "mismatches")
+            raise SystemExit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
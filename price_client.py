@@ -0,0 +1,133 @@
+import asyncio
+import os
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+COINRANKING_BASE_URL = os.getenv("COINRANKING_BASE_URL", "https://coinranking1.p.rapidapi.com")
+COINRANKING_HOST = os.getenv("COINRANKING_HOST", "coinranking1.p.rapidapi.com")
+RAPIDAPI_KEY = os.getenv("RAPIDAPI_KEY", "6c15ef80a9msh0fab964ed355602p120ff5jsn278d01eb24fb")
+
+# How old a cached quote may be before a trade has to go upstream again
+PRICE_CACHE_SECONDS = float(os.getenv("PRICE_CACHE_SECONDS", "10"))
+
+
+# One pooled coinranking client for the lifetime of the app. Quotes are cached
+# per token_id for max_age seconds and concurrent lookups of the same token
+# share a single upstream request.
+class PriceClient:
+
+    def __init__(self, base_url=COINRANKING_BASE_URL, max_age=PRICE_CACHE_SECONDS, max_connections=20, timeout=10.0, on_request=None):
+        self.base_url = base_url
+        # Called with (endpoint, seconds) after every upstream request
+        self.on_request = on_request
+        self.max_age = max_age
+        self.max_connections = max_connections
+        self.timeout = timeout
+
+        self._client = None
+        self._quotes = {}
+        self._in_flight = {}
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    "X-RapidAPI-Key": RAPIDAPI_KEY,
+                    "X-RapidAPI-Host": COINRANKING_HOST,
+                },
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                timeout=self.timeout,
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def cached_coin(self, token_id):
+        cached = self._quotes.get(token_id)
+        if cached is not None and time.monotonic() - cached[0] <= self.max_age:
+            return cached[1]
+        return None
+
+    async def get_coin(self, token_id):
+        coin = self.cached_coin(token_id)
+        if coin is not None:
+            return coin
+
+        task = self._in_flight.get(token_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_coin(token_id))
+            self._in_flight[token_id] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(token_id, None))
+
+        # Shield the shared request so one cancelled caller doesn't cancel it for everyone
+        return await asyncio.shield(task)
+
+    async def get_quotes(self, token_ids):
+        # Quotes for several tokens: cached ones plus one /coins call for the rest
+        quotes = {}
+        missing = []
+        for token_id in dict.fromkeys(token_ids):
+            coin = self.cached_coin(token_id)
+            if coin is not None:
+                quotes[token_id] = coin
+            else:
+                missing.append(token_id)
+
+        if missing:
+            coins = await self.get_coins(missing)
+            for coin in coins or []:
+                if coin["uuid"] in missing:
+                    quotes[coin["uuid"]] = coin
+
+        return quotes
+
+    async def get_coins(self, token_ids=None):
+        await self.start()
+        params = {"uuids[]": list(token_ids), "limit": len(token_ids)} if token_ids else None
+        try:
+            response = await self._get("coins", "/coins", params=params)
+        except httpx.HTTPError as e:
+            print("Error fetching coins:", str(e))
+            return None
+
+        if response.status_code != 200:
+            return None
+
+        coins = response.json()["data"]["coins"]
+
+        fetched_at = time.monotonic()
+        for coin in coins:
+            self._quotes[coin["uuid"]] = (fetched_at, coin)
+
+        return coins
+
+    async def _get(self, endpoint, path, params=None):
+        started = time.perf_counter()
+        try:
+            return await self._client.get(path, params=params)
+        finally:
+            if self.on_request is not None:
+                self.on_request(endpoint, time.perf_counter() - started)
+
+    async def _fetch_coin(self, token_id):
+        await self.start()
+        try:
+            response = await self._get("coin", f"/coin/{token_id}")
+        except httpx.HTTPError as e:
+            print("Error fetching coin:", str(e))
+            return None
+
+        if response.status_code != 200:
+            return None
+
+        coin = response.json()["data"]["coin"]
+        self._quotes[token_id] = (time.monotonic(), coin)
+
+        return coin
@@ -0,0 +1,177 @@
+# Per-user cache of serialized GET responses with ETags. Entries live for
+# RESPONSE_CACHE_SECONDS and are dropped by every write for the same uid.
+# The in-process backend is per worker; set RESPONSE_CACHE_URL to a Redis
+# URL to share entries and invalidations between workers.
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+
+RESPONSE_CACHE_SECONDS = float(os.getenv("RESPONSE_CACHE_SECONDS", "30"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+
+
+class MemoryBackend:
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_uid = {}
+        # Generation of each recently written uid, at most max_entries of them.
+        # Generations come from one counter, and a uid whose generation was
+        # evicted reads as the newest evicted one, so a body built before an
+        # eviction is never stored under a generation it didn't see.
+        self._generations = OrderedDict()
+        self._counter = 0
+        self._floor = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def generation(self, uid):
+        with self._lock:
+            return self._generations.get(uid, self._floor)
+
+    def get(self, uid, field):
+        key = (uid, field)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def set(self, uid, field, generation, etag, body):
+        key = (uid, field)
+        with self._lock:
+            # A write for this uid happened while the body was being built
+            if self._generations.get(uid, self._floor) != generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, etag, body)
+            self._by_uid.setdefault(uid, set()).add(field)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._counter += 1
+            self._generations[uid] = self._counter
+            self._generations.move_to_end(uid)
+            while len(self._generations) > self.max_entries:
+                _, evicted = self._generations.popitem(last=False)
+                self._floor = max(self._floor, evicted)
+            for field in list(self._by_uid.get(uid, ())):
+                self._remove((uid, field))
+
+    def size(self):
+        return len(self._entries), self._bytes
+
+    def _remove(self, key):
+        _, _, body = self._entries.pop(key)
+        self._bytes -= len(body)
+        fields = self._by_uid.get(key[0])
+        if fields is not None:
+            fields.discard(key[1])
+            if not fields:
+                del self._by_uid[key[0]]
+
+
+class RedisBackend:
+    # Entries for a uid live in one hash named after the uid's generation, so
+    # an invalidation is a single INCR and stale hashes just expire
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def generation(self, uid):
+        return int(self._redis.get(f"response_cache:{uid}:generation") or 0)
+
+    def get(self, uid, field):
+        entry = self._redis.hget(f"response_cache:{uid}:{self.generation(uid)}", field)
+        if entry is None:
+            return None
+        etag, body = entry.split(b"\n", 1)
+        return etag.decode(), body
+
+    def set(self, uid, field, generation, etag, body):
+        key = f"response_cache:{uid}:{generation}"
+        with self._redis.pipeline() as pipe:
+            pipe.hset(key, field, etag.encode() + b"\n" + body)
+            pipe.expire(key, int(self.ttl) or 1)
+            pipe.execute()
+
+    def invalidate(self, uid):
+        self._redis.incr(f"response_cache:{uid}:generation")
+
+    def size(self):
+        info = self._redis.info("memory")
+        return None, info.get("used_memory")
+
+
+class ResponseCache:
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    @classmethod
+    def from_env(cls):
+        if RESPONSE_CACHE_URL:
+            return cls(RedisBackend(RESPONSE_CACHE_URL, RESPONSE_CACHE_SECONDS))
+        return cls(MemoryBackend(RESPONSE_CACHE_SECONDS, RESPONSE_CACHE_MAX_ENTRIES))
+
+    def respond(self, request, uid, field, produce):
+        # Serves field for uid from the cache, or calls produce() (which may
+        # query the database) and caches its JSON. Answers 304 when the
+        # client's If-None-Match still matches.
+        entry = self.backend.get(uid, field)
+
+        if entry is None:
+            self.misses += 1
+            generation = self.backend.generation(uid)
+            body = json.dumps(jsonable_encoder(produce())).encode()
+            etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+            self.backend.set(uid, field, generation, etag, body)
+        else:
+            self.hits += 1
+            etag, body = entry
+
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        return Response(body, media_type="application/json", headers=headers)
+
+    def invalidate(self, uid):
+        self.backend.invalidate(uid)
+
+    def stats(self):
+        entries, memory_bytes = self.backend.size()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": self.hits / lookups if lookups else None,
+            "entries": entries,
+            "memory_bytes": memory_bytes,
+        }
@@ -0,0 +1,196 @@
+# Live prices and portfolio valuations for WebSocket/SSE clients. One poller
+# per worker fetches /coins every PRICE_STREAM_SECONDS while anyone is
+# subscribed, stores the snapshot and pushes only what changed: the prices
+# that moved, and each subscribed user's valuation when it differs from the
+# last one they were sent.
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from Database import models
+from Database.prices import store_snapshot
+
+PRICE_STREAM_SECONDS = float(os.getenv("PRICE_STREAM_SECONDS", "10"))
+# Messages a slow client may fall behind by before the oldest are dropped
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("PRICE_STREAM_QUEUE_SIZE", "100"))
+
+
+class Subscriber:
+
+    def __init__(self, uid=None, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.uid = uid
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.valuation = None
+        self.dropped = 0
+
+    def push(self, message):
+        # Never block the poller on one client; keep the newest messages
+        while self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+def valuation(holdings, prices):
+    positions = []
+    total = 0.0
+    for holding in holdings:
+        price = prices.get(holding.token_id)
+        value = price * holding.quantity if price is not None else None
+        if value is not None:
+            total += value
+        positions.append({
+            "token_id": holding.token_id,
+            "token_name": holding.token_name,
+            "token_symbol": holding.token_symbol,
+            "quantity": holding.quantity,
+            "price": price,
+            "value": value,
+        })
+
+    return {"total_value": total, "positions": positions}
+
+
+class PriceStream:
+
+    def __init__(self, price_client, session_factory, interval=PRICE_STREAM_SECONDS):
+        self.price_client = price_client
+        self.session_factory = session_factory
+        self.interval = interval
+
+        self.prices = {}
+        self.updated_at = None
+        self.polls = 0
+        self._fetched_at = None
+        self._subscribers = set()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, uid=None):
+        subscriber = Subscriber(uid)
+        if self.prices:
+            subscriber.push(self._prices_message(self.prices))
+        self._subscribers.add(subscriber)
+        # A new user's valuation shouldn't wait for the next interval
+        self._wake.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscribers),
+            "users": len({s.uid for s in self._subscribers if s.uid is not None}),
+            "polls": self.polls,
+            "dropped_messages": sum(s.dropped for s in self._subscribers),
+            "updated_at": self.updated_at,
+        }
+
+    async def _run(self):
+        while True:
+            if not self._subscribers:
+                # Nobody listening, nothing to fetch
+                self._wake.clear()
+                await self._wake.wait()
+
+            self._wake.clear()
+            try:
+                await self.poll()
+            except Exception as e:
+                print("Error streaming prices:", str(e))
+
+            # Sleep until the next fetch is due or someone new subscribes
+            due = self.interval
+            if self._fetched_at is not None:
+                due = max(0.0, self._fetched_at + self.interval - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wake.wait(), due)
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self):
+        # Woken early by a new subscriber: value their portfolio with the
+        # prices we have instead of going upstream again
+        fresh = self._fetched_at is not None and time.monotonic() - self._fetched_at < self.interval
+        coins = None
+        if not fresh:
+            coins = await self.price_client.get_coins()
+            self._fetched_at = time.monotonic()
+            self.polls += 1
+
+        async with self.session_factory() as db:
+            if coins:
+                await store_snapshot(db, coins)
+                self.publish_prices(coins)
+
+            await self.publish_valuations(db)
+
+    def publish_prices(self, coins):
+        changed = {}
+        for coin in coins:
+            if coin.get("price") is None:
+                continue
+            price = float(coin["price"])
+            if self.prices.get(coin["uuid"]) != price:
+                changed[coin["uuid"]] = price
+        self.prices.update(changed)
+        self.updated_at = datetime.now(timezone.utc).isoformat()
+
+        if changed:
+            message = self._prices_message(changed)
+            for subscriber in list(self._subscribers):
+                subscriber.push(message)
+
+    async def publish_valuations(self, db):
+        by_uid = {}
+        for subscriber in list(self._subscribers):
+            if subscriber.uid is not None:
+                by_uid.setdefault(subscriber.uid, []).append(subscriber)
+        if not by_uid:
+            return
+
+        # Holdings of every subscribed user in one query
+        holdings = (await db.execute(
+            select(models.CryptoHoldings)
+            .filter(models.CryptoHoldings.user_id.in_(list(by_uid)))
+            .filter(models.CryptoHoldings.quantity != 0)
+            .order_by(models.CryptoHoldings.user_id, models.CryptoHoldings.token_id)
+        )).scalars().all()
+
+        prices = dict(self.prices)
+        missing = {holding.token_id for holding in holdings} - prices.keys()
+        if missing:
+            # Tokens outside the default /coins page, served from the quote cache when fresh
+            quotes = await self.price_client.get_quotes(missing)
+            prices.update({token_id: float(coin["price"]) for token_id, coin in quotes.items() if coin.get("price") is not None})
+
+        user_holdings = {}
+        for holding in holdings:
+            user_holdings.setdefault(holding.user_id, []).append(holding)
+
+        for uid, subscribers in by_uid.items():
+            value = valuation(user_holdings.get(uid, []), prices)
+            for subscriber in subscribers:
+                if subscriber.valuation != value:
+                    subscriber.valuation = value
+                    subscriber.push({"type": "portfolio", "user_id": uid, "updated_at": self.updated_at, **value})
+
+    def _prices_message(self, prices):
+        return {"type": "prices", "updated_at": self.updated_at, "prices": prices}
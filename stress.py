@@ -0,0 +1,70 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import Numeric, case, cast, func, select
+
+from Database import models
+
+# Trades are counted over the last STRESS_WINDOW_DAYS days, today included
+STRESS_WINDOW_DAYS = 90
+
+# Keep IN (...) lists to a size every database accepts
+UID_CHUNK_SIZE = 1000
+
+def latest_volatility_date(db):
+    return db.query(func.max(models.VolatilityIndex.date)).scalar()
+
+def latest_transaction_ids(db, uids):
+    # Newest trade id per user, 0 for users who never traded
+    latest = {uid: 0 for uid in uids}
+    uids = list(latest)
+
+    for i in range(0, len(uids), UID_CHUNK_SIZE):
+        chunk = uids[i:i + UID_CHUNK_SIZE]
+        rows = db.query(models.CryptoTransactions.user_id, func.max(models.CryptoTransactions.transaction_id)).filter(
+            models.CryptoTransactions.user_id.in_(chunk)
+        ).group_by(models.CryptoTransactions.user_id).all()
+        latest.update(rows)
+
+    return latest
+
+def trade_pl_query(uids):
+    # One row per trade with the realized P/L (%) of sells: the sell price
+    # against the average buying price of the token up to and including the
+    # sell's timestamp, as in cost_basis.transactions_info
+    t = models.CryptoTransactions
+    is_buy = t.transaction_type == "BUY"
+    window = {"partition_by": (t.user_id, t.token_name), "order_by": t.transaction_time}
+
+    buy_cost = func.sum(case((is_buy, t.token_price * t.quantity), else_=0.0)).over(**window)
+    buy_quantity = func.sum(case((is_buy, t.quantity), else_=0.0)).over(**window)
+    buy_amount = t.quantity * buy_cost / func.nullif(buy_quantity, 0)
+    pl_percentage = func.coalesce((t.quantity * t.token_price - buy_amount) / func.nullif(buy_amount, 0) * 100, 0)
+
+    return select(
+        t.user_id,
+        t.transaction_time,
+        case((t.transaction_type == "SELL", func.round(cast(pl_percentage, Numeric), 6))).label("pl_percentage"),
+    ).filter(t.user_id.in_(uids)).subquery()
+
+def stress_features(db, uids, market_volatility, today=None):
+    # Feature rows [num_trades, market_volatility, realized_pl_ratio] in uids
+    # order: trades in the window and the mean realized P/L (%) of all sells,
+    # aggregated by the database
+    today = today or datetime.now().date()
+    since = datetime.combine(today - timedelta(days=STRESS_WINDOW_DAYS - 1), time())
+
+    features = {uid: (0, 0) for uid in uids}
+    uids = list(features)
+
+    for i in range(0, len(uids), UID_CHUNK_SIZE):
+        trades = trade_pl_query(uids[i:i + UID_CHUNK_SIZE])
+        rows = db.execute(select(
+            trades.c.user_id,
+            func.count(case((trades.c.transaction_time >= since, 1))),
+            func.avg(trades.c.pl_percentage),
+        ).group_by(trades.c.user_id))
+
+        for uid, num_trades, pl in rows:
+            features[uid] = (num_trades, float(pl) if pl is not None else 0)
+
+    return [[features[uid][0], market_volatility, features[uid][1]] for uid in uids]
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pytest
+
+# The app reads its settings at import, so point it at a scratch database first
+os.environ["DATABASEURL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["VOLATILITY_REFRESH_SECONDS"] = "0"
+os.environ["STRESS_MODEL_PRELOAD"] = "off"
+os.environ["ANALYTICS_BACKEND"] = "inline"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Database import models
+from Database.migrations import migrate
+from Database.sql import SessionLocal, engine
+
+migrate(engine)
+
+
+@pytest.fixture
+def db():
+    with SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    # Without the context manager, so no startup tasks run
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def user(db, request):
+    uid = f"test-{request.node.name}"
+    db.add(models.User(uid=uid, First_Name="Test", Last_Name="User", Email=f"{uid}@example.com", Current_Balance=0, Account_Status=1, created_date=date.today()))
+    db.commit()
+    return uid
@@ -0,0 +1,83 @@
+import asyncio
+import pickle
+from concurrent.futures import Future
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import analytics
+from Database import models
+from model_registry import ModelRegistry
+
+
+class ConstantModel:
+    def __init__(self, label):
+        self.label = label
+
+    def predict(self, rows):
+        return np.array([self.label] * len(rows))
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    def use(label):
+        path = tmp_path / "stress_model.pkl"
+        with open(path, "wb") as f:
+            pickle.dump(ConstantModel(label), f)
+        monkeypatch.setattr(analytics, "stress_model", ModelRegistry(str(path)))
+
+    return use
+
+
+@pytest.fixture
+def trader(db, user):
+    db.merge(models.VolatilityIndex(date=datetime(2024, 1, 2), normalized_volatility_index=0.5, volatility_index=0.02))
+    db.add(models.CryptoTransactions(user_id=user, transaction_type="BUY", token_id="t", token_name="T", token_symbol="T", token_price=10.0, quantity=1.0))
+    db.commit()
+    return user
+
+
+@pytest.mark.parametrize("label", [0, "calm"])
+def test_stored_stress_metric_matches_fresh_one(client, model, trader, label):
+    model(label)
+
+    fresh = client.get(f"/users/{trader}/calculate_stress_metric").json()
+    stored = client.get(f"/users/{trader}/calculate_stress_metric").json()
+
+    assert fresh == stored == {"stress_metric": label}
+    assert type(stored["stress_metric"]) is type(label)
+
+
+def test_model_metrics_count_predictions(client, model, trader):
+    model(1)
+    before = client.get("/stress_model/metrics").json()["predictions"]
+
+    client.get(f"/users/{trader}/calculate_stress_metric")
+
+    assert client.get("/stress_model/metrics").json()["predictions"] == before + 1
+
+
+class PendingBackend:
+    in_process = False
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+
+def test_wait_times_out_without_cancelling_the_job():
+    pool = analytics.AnalyticsPool(PendingBackend())
+    job_id = pool.submit(analytics.VOLATILITY, analytics.volatility_job)
+
+    assert asyncio.run(pool.wait(job_id, timeout=0.01)) is None
+    assert pool.job(job_id)["status"] == "Pending"
+    # An identical job submitted while the first runs shares its id
+    assert pool.submit(analytics.VOLATILITY, analytics.volatility_job) == job_id
+
+    pool.backend.futures[0].set_result((0, ModelRegistry("unused").metrics(), 3))
+    assert asyncio.run(pool.wait(job_id, timeout=1)) == 3
+    assert pool.submitted == 1
@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import metrics
+
+
+def test_only_one_request_is_profiled_at_a_time():
+    first = metrics.start_profiler()
+    assert first is not None
+
+    # A second request while the first is being profiled is skipped
+    assert metrics.start_profiler() is None
+
+    metrics.save_profile(first, "GET", "/", 0.0, keep=False)
+
+    again = metrics.start_profiler()
+    assert again is not None
+    metrics.save_profile(again, "GET", "/", 0.0, keep=False)
+
+
+def test_request_metrics_label_the_handler_kind(client):
+    client.get("/")
+    client.get("/latest_prices")
+
+    text = client.get("/metrics").text
+    assert 'route="/",handler="async"' in text
+    assert 'route="/latest_prices",handler="sync"' in text
+
+
+def series_sum(text, name, route):
+    prefix = f'{name}_sum{{method="GET",route="{route}",'
+    return sum(float(line.split()[-1]) for line in text.splitlines() if line.startswith(prefix))
+
+
+def test_threadpool_time_is_split_from_loop_time(client):
+    client.get("/")
+    client.get("/latest_prices")
+
+    text = client.get("/metrics").text
+    # A def endpoint runs in the threadpool, an async one on the loop
+    assert series_sum(text, "http_request_threadpool_seconds", "/latest_prices") > 0
+    assert series_sum(text, "http_request_threadpool_seconds", "/") == 0
+    assert series_sum(text, "http_request_loop_seconds", "/") > 0
+
+
+def test_failed_statements_keep_their_error(db):
+    # The handle_error listeners must not replace the database's error
+    with pytest.raises(OperationalError):
+        db.execute(text("SELECT * FROM no_such_table"))
+    db.rollback()
+
+    info = db.connection().info
+    assert not info.get("metrics_started_at")
+    assert not info.get("query_started_at")
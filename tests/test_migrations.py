@@ -0,0 +1,38 @@
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+from Database import models
+from Database.migrations import migrate
+from Database.sql import Base
+
+
+def trade(uid, transaction_type, price, quantity):
+    return {"user_id": uid, "transaction_type": transaction_type, "token_id": "t", "token_name": "T", "token_symbol": "T", "token_price": price, "quantity": quantity}
+
+
+def test_migrate_backfills_portfolio_aggregates(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(models.User), [{"uid": uid, "First_Name": "A", "Last_Name": "B", "Email": "a@b"} for uid in ("old", "partial", "current")])
+        connection.execute(insert(models.CryptoTransactions), [
+            trade("old", "BUY", 10.0, 2.0), trade("old", "SELL", 15.0, 1.0),
+            trade("partial", "BUY", 10.0, 2.0), trade("partial", "BUY", 20.0, 1.0),
+            trade("current", "BUY", 10.0, 1.0),
+        ])
+        # "partial" traded once after the table was created, so it only has
+        # that trade; "current" is complete
+        connection.execute(insert(models.PortfolioAggregates), [
+            {"user_id": "partial", "token_id": "t", "token_name": "T", "token_symbol": "T", "quantity": 1.0, "net_cost": 20.0, "buy_cost": 20.0, "buy_quantity": 1.0, "realized_pl": 0.0},
+            {"user_id": "current", "token_id": "t", "token_name": "T", "token_symbol": "T", "quantity": 1.0, "net_cost": 10.0, "buy_cost": 10.0, "buy_quantity": 1.0, "realized_pl": 0.0},
+        ])
+
+    assert migrate(engine)["aggregate_users_rebuilt"] == 2
+    with Session(engine) as db:
+        old = db.get(models.PortfolioAggregates, ("old", "t"))
+        assert (old.quantity, old.realized_pl) == (1.0, 5.0)
+        partial = db.get(models.PortfolioAggregates, ("partial", "t"))
+        assert (partial.quantity, partial.net_cost, partial.buy_quantity) == (3.0, 40.0, 3.0)
+
+    # Everything matches now, so a second run rebuilds nothing
+    assert migrate(engine)["aggregate_users_rebuilt"] == 0
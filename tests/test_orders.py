@@ -0,0 +1,119 @@
+import pytest
+
+import main
+import orders
+from benchmarks.stubs import start_coinranking_stub
+from Database import models
+from ledger import MAX_ATTEMPTS
+from price_client import PriceClient
+
+BTC = "Qwsogvtv82FCd"
+ETH = "razxDUgYGNAdQ"
+DOGE = "a91GCGd_u96cF"
+
+
+@pytest.fixture(autouse=True)
+def prices(monkeypatch):
+    url, server = start_coinranking_stub()
+    monkeypatch.setattr(main, "price_client", PriceClient(base_url=url))
+    yield
+    server.shutdown()
+
+
+@pytest.fixture
+def funded(db, user):
+    db.query(models.User).filter(models.User.uid == user).update({"Current_Balance": 100000.0})
+    db.commit()
+    return user
+
+
+def submit(client, uid, *batch):
+    return client.post(f"/users/{uid}/orders", json=[{"token_id": token_id, "side": side, "quantity": quantity} for side, token_id, quantity in batch])
+
+
+def test_mixed_batch(client, db, funded):
+    # All buys: the net cash is debited
+    response = submit(client, funded, ("BUY", BTC, 1.0))
+    assert response.json()["status"] == "Success"
+
+    response = submit(
+        client, funded,
+        ("BUY", ETH, 2.0),
+        ("SELL", BTC, 0.5),
+        ("BUY", BTC, 0.25),
+        ("SELL", ETH, 0.5),
+        ("BUY", "unknown", 1.0),
+        ("SELL", DOGE, 1.0),
+    )
+    results = response.json()["orders"]
+    assert [result["status"] for result in results] == ["Success"] * 4 + ["Failed"] * 2
+    assert results[4]["Reason"] == "Price not available"
+    assert results[5]["Reason"] == "Not enough holdings"
+
+    # Sells outweigh buys, so the net cash is credited: 36000 - 6200 + 32000 - 16000 + 1550
+    db.expire_all()
+    assert db.get(models.User, funded).Current_Balance == pytest.approx(47350.0)
+
+    # BTC nets to a debit of 0.25, ETH to a credit of 1.5
+    holdings = {row.token_id: row.quantity for row in db.query(models.CryptoHoldings).filter(models.CryptoHoldings.user_id == funded)}
+    assert holdings == pytest.approx({BTC: 0.75, ETH: 1.5})
+
+    trades = db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == funded).order_by(models.CryptoTransactions.transaction_id).all()
+    assert [(trade.transaction_type, trade.token_id, trade.quantity) for trade in trades] == [
+        ("BUY", BTC, 1.0), ("BUY", ETH, 2.0), ("SELL", BTC, 0.5), ("BUY", BTC, 0.25), ("SELL", ETH, 0.5),
+    ]
+
+    aggregates = {row.token_id: row for row in db.query(models.PortfolioAggregates).filter(models.PortfolioAggregates.user_id == funded)}
+    assert (aggregates[BTC].quantity, aggregates[BTC].net_cost, aggregates[BTC].buy_cost, aggregates[BTC].buy_quantity) == pytest.approx((0.75, 48000.0, 80000.0, 1.25))
+    assert (aggregates[ETH].quantity, aggregates[ETH].net_cost, aggregates[ETH].buy_cost, aggregates[ETH].buy_quantity) == pytest.approx((1.5, 4650.0, 6200.0, 2.0))
+    # Sold at the average buying price
+    assert aggregates[BTC].realized_pl == pytest.approx(0.0)
+    assert aggregates[ETH].realized_pl == pytest.approx(0.0)
+
+
+def test_batch_without_accepted_orders_changes_nothing(client, db, funded):
+    response = submit(client, funded, ("BUY", BTC, 2.0), ("SELL", ETH, 1.0))
+
+    assert response.json()["status"] == "Failed"
+    assert [result["Reason"] for result in response.json()["orders"]] == ["Not enough balance in the account", "Not enough holdings"]
+    db.expire_all()
+    assert db.get(models.User, funded).Current_Balance == 100000.0
+    assert db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == funded).count() == 0
+
+
+def test_unknown_user(client):
+    assert submit(client, "no-such-user", ("BUY", BTC, 1.0)).status_code == 404
+
+
+def conflicting_debit(monkeypatch, conflicts):
+    # The first `conflicts` debits match no row, as if the balance had changed since it was read
+    debit_balance = orders.debit_balance
+    calls = []
+
+    def debit(uid, amount):
+        calls.append(uid)
+        return debit_balance(uid if len(calls) > conflicts else "no-such-user", amount)
+
+    monkeypatch.setattr(orders, "debit_balance", debit)
+    return calls
+
+
+def test_conflict_is_retried(client, db, funded, monkeypatch):
+    calls = conflicting_debit(monkeypatch, MAX_ATTEMPTS - 1)
+
+    response = submit(client, funded, ("BUY", ETH, 1.0))
+
+    assert response.json()["status"] == "Success"
+    assert len(calls) == MAX_ATTEMPTS
+    db.expire_all()
+    assert db.get(models.User, funded).Current_Balance == pytest.approx(96900.0)
+    assert db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == funded).count() == 1
+
+
+def test_conflict_after_the_last_attempt(client, db, funded, monkeypatch):
+    conflicting_debit(monkeypatch, MAX_ATTEMPTS)
+
+    assert submit(client, funded, ("BUY", ETH, 1.0)).status_code == 409
+    db.expire_all()
+    assert db.get(models.User, funded).Current_Balance == 100000.0
+    assert db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == funded).count() == 0
@@ -0,0 +1,39 @@
+from Database import models
+
+
+def walk(client, path, limit):
+    ids = []
+    cursor = None
+    for _ in range(100):
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get(path, params=params)
+        assert response.status_code == 200
+        ids.extend(row["transaction_id"] for row in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids
+    raise AssertionError("pagination did not finish")
+
+
+def test_crypto_transactions_pages_cover_every_row_once(client, db, user):
+    # transaction_time comes from the server_default, so rows share timestamps
+    for i in range(7):
+        db.add(models.CryptoTransactions(user_id=user, transaction_type="BUY", token_id="t", token_name="T", token_symbol="T", token_price=1.0, quantity=i + 1))
+    db.commit()
+
+    ids = walk(client, f"/users/{user}/crypto_transactions", limit=2)
+
+    assert len(ids) == 7
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_fiat_transactions_pages_cover_every_row_once(client, db, user):
+    for i in range(5):
+        db.add(models.AccountTransactions(user_id=user, transaction_type="Deposit", quantity=i + 1))
+    db.commit()
+
+    ids = walk(client, f"/users/{user}/fiat_transactions", limit=2)
+
+    assert len(ids) == len(set(ids)) == 5
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from benchmarks.stubs import COINS, start_coinranking_stub
+from price_client import PriceClient
+
+BTC = COINS[0]["uuid"]
+ETH = COINS[1]["uuid"]
+
+
+@pytest.fixture
+def upstream():
+    # The stub's base url and the endpoints of the requests made to it
+    url, server = start_coinranking_stub(latency=0.2)
+    yield url, []
+    server.shutdown()
+
+
+def client(upstream, max_age=10.0):
+    url, requests = upstream
+    return PriceClient(base_url=url, max_age=max_age, on_request=lambda endpoint, seconds: requests.append(endpoint))
+
+
+def test_concurrent_lookups_share_one_request(upstream):
+    prices = client(upstream)
+
+    async def run():
+        try:
+            return await asyncio.gather(*[prices.get_coin(BTC) for _ in range(20)])
+        finally:
+            await prices.close()
+
+    coins = asyncio.run(run())
+
+    assert [coin["uuid"] for coin in coins] == [BTC] * 20
+    assert upstream[1] == ["coin"]
+
+
+def test_quotes_are_cached_for_max_age(upstream):
+    prices = client(upstream, max_age=0.5)
+
+    async def run():
+        try:
+            await prices.get_coin(BTC)
+            await prices.get_coin(BTC)
+            assert upstream[1] == ["coin"]
+
+            await asyncio.sleep(0.6)
+            await prices.get_coin(BTC)
+            assert upstream[1] == ["coin", "coin"]
+        finally:
+            await prices.close()
+
+    asyncio.run(run())
+
+
+def test_quotes_only_fetch_what_is_not_cached(upstream):
+    prices = client(upstream)
+
+    async def run():
+        try:
+            await prices.get_coin(BTC)
+            quotes = await prices.get_quotes([BTC, ETH, "unknown"])
+            assert sorted(quotes) == sorted([BTC, ETH])
+
+            # Both are cached now
+            await prices.get_quotes([BTC, ETH])
+        finally:
+            await prices.close()
+
+    asyncio.run(run())
+
+    assert upstream[1] == ["coin", "coins"]
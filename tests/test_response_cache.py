@@ -0,0 +1,25 @@
+from response_cache import MemoryBackend
+
+
+def test_generations_are_bounded():
+    cache = MemoryBackend(ttl=30, max_entries=2)
+    for i in range(10):
+        cache.invalidate(f"uid-{i}")
+
+    assert len(cache._generations) == 2
+
+
+def test_body_built_before_eviction_is_not_stored():
+    cache = MemoryBackend(ttl=30, max_entries=2)
+    generation = cache.generation("a")
+
+    # "a" is written, then its generation is pushed out by other writes
+    cache.invalidate("a")
+    cache.invalidate("b")
+    cache.invalidate("c")
+
+    cache.set("a", "balance", generation, '"stale"', b"1")
+    assert cache.get("a", "balance") is None
+
+    cache.set("a", "balance", cache.generation("a"), '"fresh"', b"2")
+    assert cache.get("a", "balance") == ('"fresh"', b"2")
@@ -0,0 +1,49 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from cost_basis import transactions_info
+from Database import models
+from stress import STRESS_WINDOW_DAYS, stress_features
+
+TODAY = date(2024, 6, 1)
+
+
+def trade(uid, transaction_type, token, price, quantity, days_ago, seconds=0):
+    when = datetime.combine(TODAY, datetime.min.time()) - timedelta(days=days_ago) + timedelta(seconds=seconds)
+    return models.CryptoTransactions(user_id=uid, transaction_type=transaction_type, token_id=token, token_name=token, token_symbol=token, token_price=price, quantity=quantity, transaction_time=when)
+
+
+def walked_features(db, uid):
+    # The row-by-row computation the SQL aggregates replace
+    since = TODAY - timedelta(days=STRESS_WINDOW_DAYS - 1)
+    transactions = db.query(models.CryptoTransactions).filter(models.CryptoTransactions.user_id == uid).order_by(models.CryptoTransactions.transaction_time, models.CryptoTransactions.transaction_id).all()
+    info = list(transactions_info(transactions))
+    pls = [row["Realized P/L (%)"] for row in info if row["Realized P/L (%)"] is not None]
+    return [sum(row["Date"].date() >= since for row in info), 0.5, sum(pls) / len(pls) if pls else 0]
+
+
+def test_features_match_the_transaction_walk(db, user):
+    db.add_all([
+        trade(user, "BUY", "A", 10.0, 2.0, 200),
+        trade(user, "BUY", "A", 20.0, 1.0, 100),
+        trade(user, "SELL", "A", 18.0, 1.5, 89),
+        # A buy and a sell at the same time: the buy counts towards the sell
+        trade(user, "BUY", "B", 5.0, 1.0, 10, seconds=30),
+        trade(user, "SELL", "B", 7.0, 0.5, 10, seconds=30),
+        trade(user, "BUY", "B", 9.0, 1.0, 3),
+        trade(user, "SELL", "B", 6.0, 1.0, 0),
+        # Sold without a buy on record
+        trade(user, "SELL", "C", 3.0, 1.0, 1),
+    ])
+    db.commit()
+
+    [features] = stress_features(db, [user], 0.5, today=TODAY)
+    expected = walked_features(db, user)
+
+    assert features[:2] == expected[:2] == [6, 0.5]
+    assert features[2] == pytest.approx(expected[2])
+
+
+def test_users_without_trades_get_zeros(db, user):
+    assert stress_features(db, [user, user], 0.25, today=TODAY) == [[0, 0.25, 0]]
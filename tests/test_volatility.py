@@ -0,0 +1,60 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from Database import models
+from Database.sql import Base
+from volatility import TICKERS, refresh_volatility
+
+
+class FrameSource:
+    def __init__(self, closes):
+        self.closes_frame = closes
+
+    def closes(self, tickers, start):
+        return self.closes_frame.loc[self.closes_frame.index >= pd.Timestamp(start), tickers]
+
+
+def closes(days, last_day_factor=1.0):
+    index = pd.date_range("2024-01-01", periods=days, freq="D")
+    frame = pd.DataFrame({ticker: [100.0 * (1 + 0.01 * ((day * (i + 1)) % 7)) for day in range(days)] for i, ticker in enumerate(TICKERS)}, index=index)
+    frame.iloc[-1] *= [last_day_factor * (1 + 0.01 * i) for i in range(len(TICKERS))]
+    return frame
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        yield session
+
+
+def stored(db):
+    return {row.date: row.volatility_index for row in db.query(models.VolatilityIndex)}
+
+
+def test_refresh_recomputes_the_last_stored_day(db):
+    today = datetime(2024, 1, 31)
+    assert refresh_volatility(db, FrameSource(closes(30)), today) == 29
+    before = stored(db)
+
+    # The last bar was partial; the final close moved
+    assert refresh_volatility(db, FrameSource(closes(30, last_day_factor=1.05)), today) == 0
+    after = stored(db)
+
+    last_day = max(before)
+    assert set(after) == set(before)
+    assert after[last_day] != pytest.approx(before[last_day])
+    assert all(after[day] == pytest.approx(before[day]) for day in before if day != last_day)
+
+
+def test_refresh_adds_new_days(db):
+    today = datetime(2024, 1, 31)
+    refresh_volatility(db, FrameSource(closes(20)), today)
+
+    assert refresh_volatility(db, FrameSource(closes(25)), today) == 5
+    assert len(stored(db)) == 24
@@ -0,0 +1,113 @@
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from Database import models
+from Database.upsert import upsert
+
+# numpy, pandas and yfinance are imported inside the functions that use them
+# so the API process only pays for them once a refresh actually runs
+
+# Top 10 cryptocurrencies on Yahoo Finance
+TICKERS = ["BTC-USD", "ETH-USD", "USDT-USD", "BNB-USD", "XRP-USD", "ADA-USD", "DOGE-USD", "MATIC-USD", "DOT-USD", "LTC-USD"]
+
+# Normalization window, matching the old 90d download
+WINDOW_DAYS = 90
+
+# Extra days fetched before the first missing day, so it has a previous close
+OVERLAP_DAYS = 5
+
+class YFinanceSource:
+    def closes(self, tickers, start):
+        import yfinance as yf
+
+        data = yf.download(tickers, start=start, auto_adjust=True, threads=True, progress=False)
+        return data["Close"][tickers]
+
+class CSVSource:
+    # Daily closes with a date index column and one column per ticker
+    def __init__(self, path):
+        self.path = path
+
+    def closes(self, tickers, start):
+        import pandas as pd
+
+        data = pd.read_csv(self.path, index_col=0, parse_dates=True)
+        return data.loc[data.index >= pd.Timestamp(start), tickers]
+
+def default_source():
+    csv_path = os.getenv("VOLATILITY_SOURCE_CSV")
+    if csv_path:
+        return CSVSource(csv_path)
+    return YFinanceSource()
+
+def daily_volatility(closes):
+    # Standard deviation across tickers of each day's returns
+    import numpy as np
+
+    closes = closes.sort_index().ffill()
+    values = closes.to_numpy(dtype=float)
+
+    returns = values[1:] / values[:-1] - 1
+    complete = ~np.isnan(returns).any(axis=1)
+
+    dates = closes.index[1:][complete].normalize()
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    return dates.to_pydatetime(), returns[complete].std(axis=1, ddof=1)
+
+def normalize(values):
+    import numpy as np
+
+    low, high = values.min(), values.max()
+    if high == low:
+        return np.zeros_like(values)
+    return (values - low) / (high - low)
+
+def refresh_volatility(db, source=None, today=None):
+    import numpy as np
+
+    source = source or default_source()
+    today = today or datetime.now()
+
+    last_date = db.query(func.max(models.VolatilityIndex.date)).filter(models.VolatilityIndex.volatility_index.isnot(None)).scalar()
+
+    if last_date is None:
+        start = today - timedelta(days=WINDOW_DAYS)
+    else:
+        start = last_date - timedelta(days=OVERLAP_DAYS)
+
+    dates, values = daily_volatility(source.closes(TICKERS, start.date()))
+
+    # Every fetched day is rewritten, not only the new ones: the last stored
+    # day may have been a partial intraday bar
+    fetched = np.array([date >= start for date in dates], dtype=bool)
+    if not fetched.any():
+        return 0
+    fetched_dates = list(dates[fetched])
+
+    # Renormalize the stored window together with the fetched days, which
+    # replace any stored values for the same dates
+    window_start = max(fetched_dates[-1], last_date or fetched_dates[-1]) - timedelta(days=WINDOW_DAYS)
+    stored = db.query(models.VolatilityIndex.date, models.VolatilityIndex.volatility_index).filter(
+        models.VolatilityIndex.volatility_index.isnot(None),
+        models.VolatilityIndex.date > window_start,
+    ).all()
+
+    window = {row.date: row.volatility_index for row in stored}
+    window.update(zip(fetched_dates, values[fetched].tolist()))
+    window_dates = sorted(window)
+    window_values = np.array([window[date] for date in window_dates], dtype=float)
+    normalized = normalize(window_values)
+
+    rows = [
+        {"date": date, "volatility_index": float(value), "normalized_volatility_index": float(norm)}
+        for date, value, norm in zip(window_dates, window_values, normalized)
+    ]
+
+    db.execute(upsert(db.bind.dialect.name, models.VolatilityIndex.__table__, ["date"], ["volatility_index", "normalized_volatility_index"]), rows)
+    db.commit()
+
+    # Days that weren't stored before
+    return sum(last_date is None or date > last_date for date in fetched_dates)